@@ -1,71 +1,579 @@
+import argparse
 import os
 import sys
-from sqlalchemy import create_engine
-from storage.sqlsession import session_scope, Base
-from scrape.scrape_filers import FDICFilerScraper
-from scrape.scrape_listing import FDICOwnFilingScraper
-from scrape.scrape_trades import FDICInsiderFileScraper
-from storage.transactions import FDICTradeHandler
+from contextlib import contextmanager
 
+# Heavy dependencies (sqlalchemy, lxml, requests, pyodbc) are imported inside the
+# functions that need them, so each stage only pays for the modules it touches.
 
-def get_mssql_engine():
+SETTINGS_KEYS = ("database", "table")
+
+
+def get_settings_path():
+    if hasattr(sys, "frozen"):
+        path = os.path.dirname(sys.executable)
+    else:
+        path = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(path, "settings.cfg")
+
+
+def read_settings():
+    settings = {}
+    with open(get_settings_path(), 'r') as infile:
+        for line in infile:
+            # Skip blank lines, and only split on the first "=" so values may contain one
+            if "=" in line:
+                key, value = line.strip().split("=", 1)
+                settings[key.strip()] = value.strip()
+    return settings
+
+
+def get_mssql_engine(echo=False):
     try:
-        config_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), "settings.cfg")
-        with open(config_file, 'r') as infile:
-            settings = dict([line.strip().split("=") for line in infile.readlines()])
+        settings = read_settings()
     except FileNotFoundError as e:
-        settings = None
         filename = create_blank_settings_file()
-        print("Required settings.cfg file is missing. A blank settings.cfg has been created at %s."  % filename)
+        print("Required settings.cfg file is missing. A blank settings.cfg has been created at %s." % filename)
         print("Input server name and table name and retry.")
         exit(0)
 
-    connection_string = "mssql+pyodbc://%s/%s" % (settings.get("database"), settings.get("table"))
-    return create_engine(connection_string, echo=True)
+    from sqlalchemy import create_engine
+    # An optional url= setting connects to any other SQLAlchemy database instead
+    connection_string = settings.get("url") or "mssql+pyodbc://%s/%s" % (
+        settings.get("database"), settings.get("table"))
+    return create_engine(connection_string, echo=echo)
+
 
 def create_blank_settings_file():
-    if hasattr(sys, "frozen"):
-        path = os.path.dirname(sys.executable)
-    else:
-        path = os.path.dirname(__file__)
-    filename = os.path.join(path, "settings.cfg")
+    filename = get_settings_path()
 
-    with open(os.path.join(path, "settings.cfg"), "w") as outfile:
-        outfile.write("database=")
-        outfile.write("table=")
+    with open(filename, "w") as outfile:
+        for key in SETTINGS_KEYS:
+            outfile.write("%s=\n" % key)
 
     return filename
 
-def main():
-    engine = get_mssql_engine()
-    Base.metadata.create_all(engine)
-    with session_scope(engine) as session:
-        # Scrape the list of filers
-        f0 = FDICFilerScraper()
-        filers = f0.update(session)
 
-        # Scrape the file listing for each filer
-        f1 = FDICOwnFilingScraper()
-        #f1.update(session, "35095")
-        for filer in filers:
-            f1.update(session, filer.get("Cert Number"))
+@contextmanager
+def open_session(engine, args):
+    """session_scope, bounded by the --row-budget/--byte-budget options when given"""
+    from storage.sqlsession import session_scope, BudgetedSession
+
+    byte_budget = args.byte_budget * 1024 * 1024 if args.byte_budget else None
+    with session_scope(engine, args.row_budget, byte_budget) as session:
+        yield session
+        if isinstance(session, BudgetedSession):
+            counters = session.counters()
+            sys.stderr.write("Session: %(rows_total)d rows in %(checkpoints)d checkpoints, "
+                             "identity map %(identity_map_size)d, RSS %(rss)s bytes\n" % counters)
+
+
+def create_tables(engine, *models):
+    """Create only the tables for the given models (and nothing else) if they are missing."""
+    from storage.sqlsession import Base
+    tables = [model.__table__ for model in models]
+    # Include the staging tables used to upsert these models
+    names = [table.name for table in tables]
+    tables += [table for table in Base.metadata.sorted_tables if table.info.get("staging_for") in names]
+    Base.metadata.create_all(engine, tables=tables)
+
+
+def report_dropped_rows(source, dropped, end_progress=True):
+    """Report the rows a parsed page dropped for not matching their column headers, on stderr.
+    end_progress starts a new line after a progress line on stdout."""
+    from scrape.scrape_trades import FDICInsiderFileScraper
+    sys.stdout.flush()
+    sys.stderr.write("%sDropped rows not matching their column headers from %s: %s\n" % (
+        "\n" if end_progress else "", source, FDICInsiderFileScraper.describe_dropped_rows(dropped)))
+
+
+def run_filers(session):
+    from scrape.scrape_filers import FDICFilerScraper
+
+    # Scrape the list of filers
+    return FDICFilerScraper().update(session)
+
+
+def run_listings(session, certs):
+    from scrape.scrape_listing import FDICOwnFilingScraper
+
+    # Scrape the file listing for each filer, upserting the listings in batches
+    f1 = FDICOwnFilingScraper(batch_size=500)
+    for cert in certs:
+        f1.update(session, cert)
+    f1.flush(session)
+
+
+def run_filings(session, limit=None, writer=None, scheduler=None):
+    from scrape.scheduler import FDICFilingScheduler
+    from scrape.scrape_listing import FDICOwnFilingScraper
+    from scrape.scrape_trades import FDICInsiderFileScraper
+    from storage.transactions import FDICTradeHandler
+
+    # From the full file listing, identify those that do not exist on the DB
+    existing_discl_ids = FDICTradeHandler.get_existing_discl_ids(session)
+    new_filings = FDICOwnFilingScraper.get_new_filings(session, [item for (item,) in existing_discl_ids])
+
+    # Fetch watch-listed and recent filings first, sharing capacity with the backfill
+    if scheduler is None:
+        scheduler = FDICFilingScheduler()
+    scheduler.add_all(new_filings)
+    total = min(len(scheduler), limit) if limit else len(scheduler)
+
+    print("%d new files identified. Beginning scrape." % len(scheduler))
+    for i in range(total):
+        filing = scheduler.pop()
+        sys.stdout.write("\rRequesting file #%d/%d @ %s" % (i + 1, total, filing.url))
+        sys.stdout.flush()
+
+        # Scrape the table
+        f2 = FDICInsiderFileScraper(filing.url)
+        f2.update(session, writer)
+        if f2.get_dropped_rows():
+            report_dropped_rows(filing.url, f2.get_dropped_rows())
+    if total:
+        sys.stdout.write("\n")
+
+
+def run_revalidate(session, recency_days, include_all=False):
+    from scrape.scrape_trades import FDICInsiderFileScraper
+    from storage.fingerprints import FDICTransFingerprint
+    from storage.transactions import FDICTradeHandler
+
+    # Only loaded disclosures that are recent, or whose listing metadata changed, are re-fetched
+    existing_discl_ids = [item for (item,) in FDICTradeHandler.get_existing_discl_ids(session)]
+    candidates = FDICTransFingerprint.get_candidates(session, existing_discl_ids, recency_days, include_all)
+
+    print("%d files due for revalidation." % len(candidates))
+    replaced = 0
+    for i, (filing, fingerprint) in enumerate(candidates):
+        sys.stdout.write("\rRevalidating file #%d/%d @ %s" % (i + 1, len(candidates), filing.url))
+        sys.stdout.flush()
+
+        # Each replaced disclosure is committed as its own transaction
+        try:
+            f2 = FDICInsiderFileScraper(filing.url)
+            if f2.refresh(session, fingerprint):
+                replaced += 1
+            session.commit()
+            if f2.get_dropped_rows():
+                report_dropped_rows(filing.url, f2.get_dropped_rows())
+        except Exception as e:
+            session.rollback()
+            print("\nFailed to revalidate %s: %s" % (filing.url, e))
+    print("\n%d changed files replaced." % replaced)
+
+
+def get_filing_models():
+    """Returns the models written by the filings stage (and those they reference)"""
+    from storage.filers import FDICFiler
+    from storage.file_listing import FDICFiling
+    from storage.fingerprints import FDICTransFingerprint
+    from storage.footnotes import FDICNoteTerm
+    from storage.insiders import FDICInsider, FDICInsiderFiling
+    from storage.partitions import FDICTransPartition
+    from storage.sources import FDICTransSource
+    from storage.transactions import FDICTransFilerInfo, FDICTransFilingInfo, FDICTransTrade, FDICTransNotes
+
+    return (FDICFiler, FDICFiling, FDICTransFilerInfo, FDICTransFilingInfo, FDICTransTrade, FDICTransNotes,
+            FDICTransFingerprint, FDICTransSource, FDICNoteTerm, FDICInsider, FDICInsiderFiling, FDICTransPartition)
+
+
+def cmd_filers(args):
+    from storage.filers import FDICFiler
+    from storage.file_listing import FDICFiling  # Resolves the FDICFiler.filings relationship
+
+    engine = get_mssql_engine(args.echo)
+    create_tables(engine, FDICFiler)
+    with open_session(engine, args) as session:
+        run_filers(session)
+
+
+def cmd_listings(args):
+    from storage.filers import FDICFiler
+    from storage.file_listing import FDICFiling
+
+    engine = get_mssql_engine(args.echo)
+    create_tables(engine, FDICFiler, FDICFiling)
+    with open_session(engine, args) as session:
+        # Default to every filer already on the DB when no cert numbers are given
+        certs = args.cert or FDICFiler.get_local(session)
+        run_listings(session, certs)
+
+
+def cmd_filings(args):
+    from scrape.scheduler import FDICFilingScheduler
+
+    engine = get_mssql_engine(args.echo)
+    create_tables(engine, *get_filing_models())
+    scheduler = FDICFilingScheduler(FDICFilingScheduler.parse_watch_list(args.watch),
+                                    args.fresh_days, args.fresh_share)
+    with open_session(engine, args) as session:
+        if args.background_writer:
+            from storage.writer import FDICBackgroundWriter
+
+            # Loads on its own thread and session, while this thread keeps fetching
+            with FDICBackgroundWriter(engine, commit_rows=args.commit_rows,
+                                      commit_seconds=args.commit_seconds) as writer:
+                run_filings(session, args.limit, writer, scheduler)
+        else:
+            run_filings(session, args.limit, scheduler=scheduler)
+
+
+def cmd_revalidate(args):
+    engine = get_mssql_engine(args.echo)
+    create_tables(engine, *get_filing_models())
+    with open_session(engine, args) as session:
+        run_revalidate(session, args.days, args.all)
+
+
+def cmd_all(args):
+    from storage.sqlsession import Base
+    import storage.filers, storage.file_listing, storage.transactions, storage.fingerprints, storage.sources
+    import storage.footnotes, storage.insiders, storage.partitions
+
+    engine = get_mssql_engine(args.echo)
+    Base.metadata.create_all(engine)
+    with open_session(engine, args) as session:
+        filers = run_filers(session)
+        run_listings(session, [filer.get("Cert Number") for filer in filers])
 
         # Commit before fetching files to ensure the disclosure IDs are in the DB.
         # The underlying table/trade data have FK references that depend on these disclosure IDs
         session.commit()
 
-        # From the full file listing, identify those that do not exist on the DB
-        existing_discl_ids = FDICTradeHandler.get_existing_discl_ids(session)
-        new_urls = f1.get_new_urls(session, [item for (item,) in existing_discl_ids])
-        for i, url in enumerate(new_urls):
-            print("%d new files identified. Beginning scrape.")
-            sys.stdout.write("\rRequesting file #%d/%d @ %s" % (i + 1, len(new_urls), url))
+        run_filings(session)
+
+
+def cmd_reprocess(args):
+    from scrape.reprocess import FDICReprocessor
+
+    engine = get_mssql_engine(args.echo)
+    create_tables(engine, *get_filing_models())
+    with open_session(engine, args) as session:
+        def report_progress(count):
+            sys.stdout.write("\rReprocessed %d files" % count)
             sys.stdout.flush()
 
-            # Scrape the table
-            f2 = FDICInsiderFileScraper(url)
-            f2.update(session)
+        def report_error(disclosure_id, error):
+            print("\nFailed to reprocess disclosure %s: %s" % (disclosure_id, error))
+
+        def report_dropped(disclosure_id, dropped):
+            report_dropped_rows("disclosure %s" % disclosure_id, dropped)
+
+        reprocessor = FDICReprocessor(engine, processes=args.processes)
+        reprocessor.run(session, args.disclosure, report_progress, report_error, report_dropped)
+        print("\n%d files reprocessed from stored sources, %d failed." % (reprocessor.replaced, reprocessor.errors))
+
+
+def load_hook(path):
+    """Returns the callable named by a "package.module:function" path"""
+    import importlib
+    module_name, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def cmd_watch(args):
+    from scrape.daemon import FDICWatchDaemon
+    from scrape.scheduler import FDICFilingScheduler
+
+    engine = get_mssql_engine(args.echo)
+    create_tables(engine, *get_filing_models())
+
+    scheduler = FDICFilingScheduler(FDICFilingScheduler.parse_watch_list(args.watch))
+    daemon = FDICWatchDaemon(engine, scheduler, args.min_interval, args.max_interval)
+    daemon.add_hook(lambda event: print("Loaded disclosure %(disclosure_id)s for cert %(cert_number)s" % event))
+    for path in args.hook or []:
+        daemon.add_hook(load_hook(path))
+
+    try:
+        daemon.run(1 if args.once else None)
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+def cmd_search(args):
+    from storage.footnotes import FDICNoteTerm
+
+    engine = get_mssql_engine(args.echo)
+    create_tables(engine, *get_filing_models())
+    with open_session(engine, args) as session:
+        if args.rebuild:
+            def report_progress(count):
+                sys.stdout.write("\rIndexed the footnotes of %d disclosures" % count)
+                sys.stdout.flush()
+
+            FDICNoteTerm.rebuild(session, on_progress=report_progress)
+            print("")
+        if args.query:
+            for match in FDICNoteTerm.search(session, args.query, args.limit):
+                print("%d\t%.2f" % (match.disclosure_id, match.score))
+                for highlight in match.highlights:
+                    print("\t%s" % highlight)
+
+
+def cmd_insiders(args):
+    from storage.insiders import FDICInsider
+    from storage.transactions import FDICTradeHandler
+
+    engine = get_mssql_engine(args.echo)
+    create_tables(engine, *get_filing_models())
+    with open_session(engine, args) as session:
+        if args.rebuild:
+            def report_progress(count):
+                sys.stdout.write("\rIndexed the insiders of %d disclosures" % count)
+                sys.stdout.flush()
+
+            discl_ids = [item for (item,) in FDICTradeHandler.get_existing_discl_ids(session)]
+            FDICInsider.rebuild(session, discl_ids, on_progress=report_progress)
+            print("")
+
+        insiders = FDICInsider.find(session, args.name, args.zip) if args.name else []
+        insiders += [session.query(FDICInsider).get(insider_id) for insider_id in args.id or []]
+        for insider in insiders:
+            if insider is None:
+                continue
+            certs = FDICInsider.get_certs(session, insider.insider_id)
+            print("%d\t%s\t%s %s\tcerts: %s" % (insider.insider_id, insider.name, insider.city or "",
+                                                  insider.zip or "", ", ".join(str(cert) for cert in certs)))
+            for filing in FDICInsider.get_filings(session, insider.insider_id):
+                print("\t%d\t%s\t%s\tForm %s" % (filing.disclosure_id, filing.cert_number,
+                                                   filing.filing_date, filing.form_type))
+
+
+def cmd_partitions(args):
+    from storage.partitions import FDICTransPartition
+
+    engine = get_mssql_engine(args.echo)
+    create_tables(engine, *get_filing_models())
+    with open_session(engine, args) as session:
+        years = list(args.compact or [])
+        if args.hot_years:
+            years += FDICTransPartition.get_cold_years(session, args.hot_years)
+        for year in sorted(set(years)):
+            print("Compacted %d: %d rows archived." % (year, FDICTransPartition.compact(session, year)))
+        for year in args.restore or []:
+            FDICTransPartition.restore(session, year)
+            print("Restored %d to the hot tables." % year)
+
+        for year, counts in sorted(FDICTransPartition.get_hot_years(session).items()):
+            print("hot   %d\t%s" % (year, ", ".join("%s: %d" % item for item in sorted(counts.items()))))
+        for partition in FDICTransPartition.get_archives(session):
+            print("cold  %d\t%s: %d (compacted %s)" % (partition.filing_year, partition.table_name,
+                                                       partition.row_count, partition.compacted_date))
+
+
+def cmd_export(args):
+    import csv
+    from sqlalchemy import select, inspect
+    from sqlalchemy.orm import Session
+    from storage.sqlsession import Base
+    import storage.filers, storage.file_listing, storage.transactions, storage.fingerprints, storage.sources
+    import storage.footnotes, storage.insiders
+    from storage.partitions import FDICTransPartition
+
+    table = Base.metadata.tables.get(args.table)
+    if table is None:
+        print("Unknown table %s. Choose from: %s" % (args.table, ', '.join(sorted(Base.metadata.tables))))
+        exit(1)
+
+    engine = get_mssql_engine(args.echo)
+    outfile = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(outfile)
+        writer.writerow([column.name for column in table.columns])
+        with engine.connect() as conn:
+            # Partitioned tables include the rows archived for compacted filing years
+            if table in FDICTransPartition.PARTITIONED_TABLES and inspect(conn).has_table(
+                    FDICTransPartition.__tablename__):
+                table = FDICTransPartition.get_union(Session(bind=conn), table)
+            # Stream the rows rather than loading the whole table into memory
+            result = conn.execution_options(stream_results=True).execute(select(table))
+            for row in result:
+                writer.writerow(row)
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+def cmd_extract(args):
+    from scrape.extract import FDICDisclosureExtractor
+    from storage.jsonl import JSONLinesWriter
+
+    # Sources are local HTML files, filing URLs, or every filing on a cert's file listing
+    sources = []
+    if args.dir:
+        sources.extend(FDICDisclosureExtractor.list_directory(args.dir))
+    if args.urls_file:
+        with open(args.urls_file, 'r') as infile:
+            sources.extend(line.strip() for line in infile if line.strip())
+    sources.extend(args.url or [])
+    for cert in args.cert or []:
+        sources.extend(FDICDisclosureExtractor.list_cert_urls(cert))
+
+    def report_error(failure):
+        sys.stderr.write("Failed to extract %s (%s)\n" % (failure.get("source"), failure.get("error")))
+
+    def report_dropped(disclosure):
+        report_dropped_rows(disclosure["url"] or "disclosure %s" % disclosure["disclosure_id"],
+                            disclosure["dropped_rows"], end_progress=False)
+
+    extractor = FDICDisclosureExtractor(processes=args.processes)
+    with JSONLinesWriter(args.output, max_records=args.rotate) as writer:
+        extractor.run(sources, writer, on_error=report_error, on_dropped=report_dropped)
+    sys.stderr.write("%d disclosures extracted, %d failed, %d rows dropped.\n" % (
+        extractor.extracted, extractor.errors, extractor.dropped_rows))
+
+
+def cmd_layouts(args):
+    from scrape.layouts import layouts
+
+    if not layouts.log_path:
+        print("No unknown layouts are logged without --layout-log FILE (before the stage name)")
+    unknown = layouts.read_unknown()
+    if args.add:
+        # Fingerprints may be abbreviated, as printed below
+        matches = [fingerprint for fingerprint in unknown if fingerprint.startswith(args.add)]
+        if len(matches) != 1:
+            print("%s matches %d logged unknown layouts" % (args.add, len(matches)))
+            exit(1)
+        template = layouts.add(args.name or matches[0][:12], unknown[matches[0]]["headers"])
+        print("Added %r to %s" % (template, layouts.path))
+        return
+
+    for template in sorted(layouts.templates.values(), key=lambda t: t.name):
+        print("known    %s  %s" % (template.fingerprint[:12], template.name))
+    for fingerprint, entry in sorted(unknown.items(), key=lambda item: -item[1]["count"]):
+        print("unknown  %s  logged %d times, e.g. %s" % (fingerprint[:12], entry["count"], entry["source"]))
+        for section, headers in sorted(entry["headers"].items()):
+            print("             %s: %s" % (section, " | ".join(headers)))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="fdic_trans", description="Scrape FDIC beneficial ownership filings.")
+    parser.add_argument("--echo", action="store_true", help="Log all SQL statements")
+    parser.add_argument("--row-budget", type=int,
+                        help="Commit and expunge the session every N added rows, to bound memory use")
+    parser.add_argument("--byte-budget", type=int, metavar="MB",
+                        help="Commit and expunge the session every (estimated) MB of added rows")
+    parser.add_argument("--profile", metavar="DIR", help="Profile each stage, writing reports and slow pages to DIR")
+    parser.add_argument("--slow-page-seconds", type=float, default=2.0,
+                        help="With --profile, save filing pages whose fetch, parse or load takes this long")
+    parser.add_argument("--layout-log", metavar="FILE",
+                        help="Log page layouts without a template to FILE, for the layouts command")
+    parser.set_defaults(func=cmd_all)
+    subparsers = parser.add_subparsers(title="stages")
+
+    p = subparsers.add_parser("all", help="Run the filers, listings and filings stages end to end (default)")
+    p.set_defaults(func=cmd_all)
+
+    p = subparsers.add_parser("filers", help="Refresh the list of FDIC filers")
+    p.set_defaults(func=cmd_filers)
+
+    p = subparsers.add_parser("listings", help="Refresh the file listing for each filer")
+    p.add_argument("--cert", type=int, action="append", help="Cert number to refresh (repeatable). "
+                                                             "Defaults to every filer on the DB.")
+    p.set_defaults(func=cmd_listings)
+
+    p = subparsers.add_parser("filings", help="Scrape pending filings not yet on the DB")
+    p.add_argument("--limit", type=int, help="Maximum number of filings to scrape")
+    p.add_argument("--background-writer", action="store_true",
+                   help="Write to the DB on a separate thread, overlapping inserts with fetches")
+    p.add_argument("--commit-rows", type=int, default=1000, help="Background writer commit size, in rows")
+    p.add_argument("--commit-seconds", type=float, default=5.0, help="Background writer commit interval")
+    p.add_argument("--watch", action="append", metavar="CERT[:PRIORITY]",
+                   help="Fetch this cert's filings first (repeatable, higher priorities first)")
+    p.add_argument("--fresh-days", type=int, default=7, help="Filings from the last DAYS days count as fresh")
+    p.add_argument("--fresh-share", type=float, default=0.75,
+                   help="Share of fetches given to fresh filings while a backfill is pending")
+    p.set_defaults(func=cmd_filings)
+
+    p = subparsers.add_parser("revalidate", help="Re-fetch loaded filings that may have been amended, "
+                                                 "and replace those whose content changed")
+    p.add_argument("--days", type=int, default=30, help="Always revalidate filings from the last DAYS days")
+    p.add_argument("--all", action="store_true", help="Revalidate every loaded filing (e.g. to record "
+                                                      "fingerprints for filings loaded before they existed)")
+    p.set_defaults(func=cmd_revalidate)
+
+    p = subparsers.add_parser("reprocess", help="Re-derive loaded rows from the stored filing sources")
+    p.add_argument("--disclosure", type=int, action="append",
+                   help="Disclosure ID to reprocess (repeatable). Defaults to every stored source.")
+    p.add_argument("-j", "--processes", type=int, default=1, help="Number of worker processes")
+    p.set_defaults(func=cmd_reprocess)
+
+    p = subparsers.add_parser("watch", help="Run continuously, loading new filings soon after they appear")
+    p.add_argument("--min-interval", type=float, default=300, help="Shortest listing poll interval, in seconds")
+    p.add_argument("--max-interval", type=float, default=6 * 3600, help="Longest listing poll interval, in seconds")
+    p.add_argument("--watch", action="append", metavar="CERT[:PRIORITY]", help="Load this cert's filings first")
+    p.add_argument("--hook", action="append", metavar="MODULE:FUNCTION",
+                   help="Call FUNCTION(event) for each loaded disclosure (repeatable)")
+    p.add_argument("--once", action="store_true", help="Run a single poll and load cycle, then exit")
+    p.set_defaults(func=cmd_watch)
+
+    p = subparsers.add_parser("search", help="Search the loaded footnotes, best matching disclosures first")
+    p.add_argument("query", nargs="?", help='Terms that must all match, with prefix* terms and "quoted phrases"')
+    p.add_argument("--limit", type=int, default=20, help="Maximum number of disclosures to list")
+    p.add_argument("--rebuild", action="store_true", help="Index every loaded footnote first (e.g. for "
+                                                          "notes loaded before the index existed)")
+    p.set_defaults(func=cmd_search)
+
+    p = subparsers.add_parser("insiders", help="List an insider's disclosures and institutions")
+    p.add_argument("name", nargs="?", help="Insider name, in any order (e.g. \"John Q. Smith\")")
+    p.add_argument("--zip", help="Only insiders with this ZIP code")
+    p.add_argument("--id", type=int, action="append", help="Insider ID to list (repeatable)")
+    p.add_argument("--rebuild", action="store_true", help="Index the insiders of every loaded disclosure first "
+                                                          "(e.g. for disclosures loaded before the index existed)")
+    p.set_defaults(func=cmd_insiders)
+
+    p = subparsers.add_parser("partitions", help="List the hot and cold filing years of the trades and notes, "
+                                                 "or move cold years into archive tables")
+    p.add_argument("--compact", type=int, action="append", metavar="YEAR",
+                   help="Move this filing year's trades and notes into archive tables (repeatable)")
+    p.add_argument("--hot-years", type=int, metavar="N",
+                   help="Compact every filing year older than the last N years")
+    p.add_argument("--restore", type=int, action="append", metavar="YEAR",
+                   help="Move an archived filing year back into the hot tables (repeatable)")
+    p.set_defaults(func=cmd_partitions)
+
+    p = subparsers.add_parser("export", help="Write a table to CSV")
+    p.add_argument("table", help="Table name, e.g. fdic_trans_trades")
+    p.add_argument("-o", "--output", help="Output file (defaults to stdout)")
+    p.set_defaults(func=cmd_export)
+
+    p = subparsers.add_parser("extract", help="Parse filings to JSON Lines without a database")
+    p.add_argument("--dir", help="Directory of <disclosure_id>.html files to parse instead of fetching")
+    p.add_argument("--url", action="append", help="Filing URL to fetch (repeatable)")
+    p.add_argument("--urls-file", help="File with one filing URL per line")
+    p.add_argument("--cert", type=int, action="append", help="Fetch every filing listed for this cert (repeatable)")
+    p.add_argument("-j", "--processes", type=int, default=1, help="Number of worker processes")
+    p.add_argument("-o", "--output", help="Directory for rotating .jsonl.gz files, numbered after any already "
+                                          "there (defaults to stdout)")
+    p.add_argument("--rotate", type=int, default=10000, help="Disclosures per output file")
+    p.set_defaults(func=cmd_extract)
+
+    p = subparsers.add_parser("layouts", help="List known and logged unknown page layouts, or add a template")
+    p.add_argument("--add", metavar="FINGERPRINT", help="Add a template for this logged unknown layout")
+    p.add_argument("--name", help="Name for the added template, e.g. \"Form 4\"")
+    p.set_defaults(func=cmd_layouts)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.layout_log:
+        from scrape.layouts import layouts, LAYOUT_LOG_VARIABLE
+
+        # Set in the environment too, for worker processes
+        os.environ[LAYOUT_LOG_VARIABLE] = layouts.log_path = os.path.abspath(args.layout_log)
+    if args.profile:
+        from scrape.profiling import FDICProfiler
+
+        with FDICProfiler(args.profile, args.slow_page_seconds):
+            args.func(args)
+    else:
+        args.func(args)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
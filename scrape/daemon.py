@@ -0,0 +1,206 @@
+import hashlib
+import heapq
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+import requests
+from sqlalchemy import func
+from scrape.scheduler import FDICFilingScheduler, PendingFiling
+from scrape.scrape_filers import FDICFilerScraper
+from scrape.scrape_listing import FDICOwnFilingScraper
+from scrape.scrape_trades import FDICInsiderFileScraper
+from storage.file_listing import FDICFiling
+from storage.filers import FDICFiler
+from storage.normalize import FDICRowNormalizer
+from storage.sqlsession import session_scope
+from storage.transactions import FDICTradeHandler
+
+
+class FDICWatchDaemon():
+    """Polls the file listings at an adaptive cadence, and loads new filings as soon as they appear.
+
+    HTTP connections are reused through one requests.Session, and DB connections through the engine's
+    pool. Each cert's poll interval starts shorter the more it filed in the last year, halves when a
+    poll finds new filings and grows when it does not, within [min_interval, max_interval] seconds.
+    A listing page that is unchanged since the last poll is skipped without touching the DB. A filing
+    that fails to load is queued again after retry_interval seconds, doubling with each attempt, up to
+    max_retries times.
+
+    Every hook added with add_hook() is called with an event dict once a disclosure is committed."""
+
+    def __init__(self, engine, scheduler=None, min_interval=300, max_interval=6 * 3600,
+                 filers_interval=24 * 3600, loads_per_cycle=50, retry_interval=60, max_retries=5):
+        self.engine = engine
+        self.scheduler = scheduler or FDICFilingScheduler()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.filers_interval = filers_interval
+        self.loads_per_cycle = loads_per_cycle
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+        self.http = requests.Session()
+        self.hooks = []
+        self.intervals = {}
+        self.listing_hashes = {}
+        self.loaded_ids = None
+        # Maps disclosure ID to the number of failed loads, for filings waiting to be retried
+        self.attempts = {}
+        self._due = []
+        self._retries_due = []
+        self._filers_due = 0
+        self._stop = threading.Event()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, cycles=None):
+        """Poll and load until stop() is called (or for the given number of cycles)"""
+        cycle = 0
+        while not self._stop.is_set() and (cycles is None or cycle < cycles):
+            self.run_cycle()
+            cycle += 1
+
+            # Sleep until the next poll is due, unless filings are still waiting to be loaded
+            if not len(self.scheduler) and (cycles is None or cycle < cycles):
+                self._stop.wait(self.get_wait())
+
+    def run_cycle(self):
+        with session_scope(self.engine) as session:
+            if self.loaded_ids is None:
+                self.loaded_ids = set(item for (item,) in FDICTradeHandler.get_existing_discl_ids(session))
+
+            if time.monotonic() >= self._filers_due:
+                self.refresh_filers(session)
+                self._filers_due = time.monotonic() + self.filers_interval
+
+            # Only poll the certs due at the start of the cycle, since polling reschedules them
+            now = time.monotonic()
+            while self._due and self._due[0][0] <= now and not self._stop.is_set():
+                cert = heapq.heappop(self._due)[1]
+                try:
+                    listing_hash, pending = self.poll(session, cert)
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    print("Failed to poll cert %s: %s" % (cert, e))
+                    pending = []
+                else:
+                    # Only remembered once committed, so a failed poll is repeated in full
+                    self.listing_hashes[cert] = listing_hash
+                    for filing in pending:
+                        self.scheduler.add(filing)
+                        self.loaded_ids.add(filing.disclosure_id)
+                self._reschedule(cert, len(pending))
+
+            while self._retries_due and self._retries_due[0][0] <= time.monotonic():
+                self.scheduler.add(heapq.heappop(self._retries_due)[2])
+
+            for i in range(min(self.loads_per_cycle, len(self.scheduler))):
+                if self._stop.is_set():
+                    break
+                self.load(session, self.scheduler.pop())
+
+    def refresh_filers(self, session):
+        """Update the filer list, and schedule polls for certs that are not yet being watched"""
+        FDICFilerScraper(self.http).update(session)
+        session.commit()
+
+        since = date.today() - timedelta(days=365)
+        counts = dict(session.query(FDICFiling.cert_number, func.count(FDICFiling.disclosure_id)).filter(
+            FDICFiling.filing_date >= since).group_by(FDICFiling.cert_number))
+
+        for cert in FDICFiler.get_local(session):
+            if cert not in self.intervals:
+                # Frequent filers are polled more often. First polls are spread over the interval.
+                interval = self.max_interval / (1 + counts.get(cert, 0))
+                self.intervals[cert] = max(self.min_interval, interval)
+                heapq.heappush(self._due, (time.monotonic() + random.uniform(0, self.intervals[cert]), cert))
+
+    def poll(self, session, cert):
+        """Poll one cert's file listing, inserting its new file listings. Returns the listing's hash and a
+        PendingFiling for each filing not yet loaded, to be queued once the session is committed."""
+        scraper = FDICOwnFilingScraper(http=self.http)
+        filings = scraper.get_remote(cert)
+
+        listing_hash = hashlib.sha256(json.dumps(filings, sort_keys=True).encode("utf-8")).hexdigest()
+        if self.listing_hashes.get(cert) == listing_hash:
+            return listing_hash, []
+
+        scraper._insert_new(session, filings, cert)
+        scraper.flush(session)
+
+        pending = {}
+        for file in filings:
+            try:
+                disclosure_id = int(file.get("Disclosure ID"))
+            except (TypeError, ValueError):
+                continue
+            if disclosure_id not in self.loaded_ids:
+                pending[disclosure_id] = PendingFiling(disclosure_id, int(cert),
+                                                       FDICRowNormalizer.parse_date(file.get("Filing Date")),
+                                                       file.get("URL"))
+        return listing_hash, list(pending.values())
+
+    def load(self, session, filing):
+        """Fetch, load and commit one filing, then emit its "loaded" event"""
+        scraper = FDICInsiderFileScraper(filing.url, self.http)
+        try:
+            scraper.update(session)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            self._retry(filing, e)
+            return
+        self.attempts.pop(filing.disclosure_id, None)
+
+        self._emit({
+            "event": "loaded",
+            "disclosure_id": filing.disclosure_id,
+            "cert_number": filing.cert_number,
+            "filing_date": filing.filing_date,
+            "url": filing.url,
+            "dropped_rows": scraper.get_dropped_rows(),
+            "loaded_at": datetime.now()
+        })
+
+    def get_wait(self):
+        """Returns the seconds until the next poll is due"""
+        next_due = min(self._due[0][0] if self._due else self._filers_due, self._filers_due)
+        if self._retries_due:
+            next_due = min(next_due, self._retries_due[0][0])
+        return max(next_due - time.monotonic(), 0)
+
+    def _retry(self, filing, error):
+        attempts = self.attempts.get(filing.disclosure_id, 0) + 1
+        if attempts > self.max_retries:
+            # Let the next run of the filings stage pick it up
+            self.attempts.pop(filing.disclosure_id, None)
+            self.loaded_ids.discard(filing.disclosure_id)
+            print("Failed to load %s, giving up after %d attempts: %s" % (filing.url, attempts, error))
+            return
+        self.attempts[filing.disclosure_id] = attempts
+        delay = self.retry_interval * 2 ** (attempts - 1)
+        heapq.heappush(self._retries_due, (time.monotonic() + delay, filing.disclosure_id, filing))
+        print("Failed to load %s, retrying in %d seconds: %s" % (filing.url, delay, error))
+
+    def _reschedule(self, cert, found):
+        if found:
+            self.intervals[cert] = max(self.min_interval, self.intervals[cert] / 2)
+        else:
+            self.intervals[cert] = min(self.max_interval, self.intervals[cert] * 1.25)
+        heapq.heappush(self._due, (time.monotonic() + self.intervals[cert], cert))
+
+    def _emit(self, event):
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                print("Loaded event hook %r failed: %s" % (hook, e))
+
+    def __repr__(self):
+        return "<FDICWatchDaemon(certs=%d, pending=%d)>" % (len(self.intervals), len(self.scheduler))
@@ -0,0 +1,79 @@
+import os
+from multiprocessing import Pool
+from scrape.scrape_listing import FDICOwnFilingScraper
+from scrape.scrape_trades import FDICInsiderFileScraper
+
+
+def extract_one(source):
+    """Fetch (or read) and parse a single filing, returning its normalized disclosure dict.
+
+    source is either a filing URL, or the path to a local HTML file named <disclosure_id>.html.
+    Failures are returned as a dict with an "error" key so one bad page does not stop the run."""
+    try:
+        if os.path.isfile(source):
+            with open(source, 'r', encoding='utf-8', errors='replace') as infile:
+                html = infile.read()
+            disclosure_id = os.path.splitext(os.path.basename(source))[0]
+            cert_number, url = None, None
+        else:
+            html = FDICInsiderFileScraper.fetch(source)
+            disclosure_id = FDICOwnFilingScraper.parse_url_discl_id(source)
+            cert_number, url = FDICOwnFilingScraper.parse_url_certnum(source), source
+
+        table_data = FDICInsiderFileScraper.parse_html(html, source)
+        disclosure = FDICInsiderFileScraper.normalize(disclosure_id, table_data)
+        disclosure["cert_number"] = int(cert_number) if cert_number else None
+        disclosure["url"] = url
+        return disclosure
+    except Exception as e:
+        return {"source": source, "error": "%s: %s" % (type(e).__name__, e)}
+
+
+class FDICDisclosureExtractor():
+    """Extracts filings to normalized dicts without a database, using a pool of worker processes."""
+
+    def __init__(self, processes=1, chunksize=4):
+        self.processes = processes
+        self.chunksize = chunksize
+        self.extracted = 0
+        self.errors = 0
+        self.dropped_rows = 0
+
+    @classmethod
+    def list_directory(cls, directory):
+        """Returns the paths of the HTML files in directory"""
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                      if name.lower().endswith((".htm", ".html")))
+
+    @classmethod
+    def list_cert_urls(cls, cert_number):
+        """Returns the filing URLs on the file listing for cert_number"""
+        return [filing.get("URL") for filing in FDICOwnFilingScraper().get_remote(cert_number) if filing.get("URL")]
+
+    def run(self, sources, writer, on_error=None, on_dropped=None):
+        """Writes one normalized disclosure per source to writer. Returns the number of disclosures written.
+        on_dropped is called with each disclosure that dropped rows not matching their column headers."""
+        if self.processes > 1:
+            with Pool(self.processes) as pool:
+                self._write_all(pool.imap_unordered(extract_one, sources, self.chunksize), writer, on_error,
+                                on_dropped)
+        else:
+            self._write_all(map(extract_one, sources), writer, on_error, on_dropped)
+        return self.extracted
+
+    def _write_all(self, disclosures, writer, on_error, on_dropped):
+        for disclosure in disclosures:
+            if "error" in disclosure:
+                self.errors += 1
+                if on_error:
+                    on_error(disclosure)
+            else:
+                writer.write(disclosure)
+                self.extracted += 1
+                if disclosure["dropped_rows"]:
+                    self.dropped_rows += sum(disclosure["dropped_rows"].values())
+                    if on_dropped:
+                        on_dropped(disclosure)
+
+    def __repr__(self):
+        return "<FDICDisclosureExtractor(processes=%d)>" % self.processes
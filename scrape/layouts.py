@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from storage.normalize import FDICRowNormalizer
+
+# Known layouts, and the environment variable naming the (optional) log of unknown layouts seen while
+# parsing. The variable is inherited by worker processes, so they log to the same file.
+LAYOUTS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "layouts.json")
+LAYOUT_LOG_VARIABLE = "FDIC_LAYOUT_LOG"
+
+# The record kind and derivative flag for the rows of each labelled section
+SECTION_RECORDS = {
+    "Filing Information": ("issuer_info", False),
+    "Filer Information": ("filer_info", False),
+    "Table I - Non-Derivative": ("trades", False),
+    "Table II - Derivative": ("trades", True),
+}
+
+
+class FDICLayoutTemplate():
+    """Precompiled extraction for one page layout, identified by the column headers of its labelled sections.
+
+    Matching keywords to column headers is done once per layout rather than once per row, so the
+    normalizer reads each field straight from its header and converts it with its typed parser.
+    overrides maps a section's keywords to the header they should read (or None), for layouts whose
+    headers the keywords do not match on their own."""
+
+    def __init__(self, name, headers, overrides=None):
+        self.name = name
+        # Maps each labelled section to its list of column headers
+        self.headers = headers
+        self.overrides = overrides or {}
+        self.fingerprint = FDICLayoutTemplate.fingerprint_headers(headers)
+
+        # Maps (kind, derivative) to the keyword map for that section's headers
+        self.columns = {}
+        for section, section_headers in headers.items():
+            if section in SECTION_RECORDS:
+                kind, derivative = SECTION_RECORDS[section]
+                self.columns[(kind, derivative)] = FDICRowNormalizer.map_columns(
+                    dict.fromkeys(FDICRowNormalizer.get_keywords(kind, derivative)),
+                    dict.fromkeys(section_headers)
+                )
+                self.columns[(kind, derivative)].update(self.overrides.get(section, {}))
+
+    @classmethod
+    def fingerprint_headers(cls, headers):
+        """Returns a hash of the header structure, as a dict of each labelled section's column headers"""
+        return hashlib.sha256(json.dumps(headers, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get_columns(self, kind, derivative=False):
+        """Returns the precompiled keyword map for a record kind, or None to match the columns per row"""
+        return self.columns.get((kind, derivative))
+
+    def to_dict(self):
+        layout = {"name": self.name, "headers": self.headers}
+        if self.overrides:
+            layout["overrides"] = self.overrides
+        return layout
+
+    def __repr__(self):
+        return "<FDICLayoutTemplate(name=%s, fingerprint=%s)>" % (self.name, self.fingerprint[:12])
+
+
+class FDICLayoutRegistry():
+    """The known page layouts, loaded from layouts.json on first use.
+
+    Pages with a known layout are normalized through its template. Unknown layouts fall back to
+    matching columns per row. When log_path is set, each unknown layout is logged to it once per
+    process so a template can be added for it (see the layouts command)."""
+
+    def __init__(self, path=LAYOUTS_PATH, log_path=os.environ.get(LAYOUT_LOG_VARIABLE)):
+        self.path = path
+        self.log_path = log_path
+        self._templates = None
+        # Fingerprints of the unknown layouts already logged by this process
+        self._logged = set()
+
+    @property
+    def templates(self):
+        if self._templates is None:
+            self._templates = {}
+            if os.path.isfile(self.path):
+                with open(self.path, 'r', encoding='utf-8') as infile:
+                    for layout in json.load(infile):
+                        template = FDICLayoutTemplate(layout["name"], layout["headers"], layout.get("overrides"))
+                        self._templates[template.fingerprint] = template
+        return self._templates
+
+    def get(self, fingerprint):
+        return self.templates.get(fingerprint)
+
+    def match(self, headers, source=None):
+        """Returns the fingerprint of the header structure, logging it when the layout is unknown"""
+        fingerprint = FDICLayoutTemplate.fingerprint_headers(headers)
+        if self.log_path and fingerprint not in self.templates and fingerprint not in self._logged:
+            self._logged.add(fingerprint)
+            self.log_unknown(fingerprint, headers, source)
+        return fingerprint
+
+    def log_unknown(self, fingerprint, headers, source=None):
+        try:
+            with open(self.log_path, 'a', encoding='utf-8') as outfile:
+                outfile.write(json.dumps({
+                    "fingerprint": fingerprint,
+                    "headers": headers,
+                    "source": source,
+                    "logged_at": datetime.now().isoformat()
+                }, sort_keys=True) + "\n")
+        except OSError as e:
+            print("Unable to log unknown layout %s: %s" % (fingerprint[:12], e))
+
+    def read_unknown(self):
+        """Returns a dict of each logged layout that is still unknown, with the number of times it was logged"""
+        unknown = {}
+        if self.log_path and os.path.isfile(self.log_path):
+            with open(self.log_path, 'r', encoding='utf-8') as infile:
+                for line in infile:
+                    if line.strip():
+                        entry = json.loads(line)
+                        if entry["fingerprint"] not in self.templates:
+                            unknown.setdefault(entry["fingerprint"], dict(entry, count=0))["count"] += 1
+        return unknown
+
+    def add(self, name, headers):
+        """Adds a template for the header structure, and saves the known layouts. Returns the template."""
+        template = FDICLayoutTemplate(name, headers)
+        self.templates[template.fingerprint] = template
+        with open(self.path, 'w', encoding='utf-8') as outfile:
+            json.dump([t.to_dict() for t in sorted(self.templates.values(), key=lambda t: t.name)],
+                      outfile, indent=2, sort_keys=True)
+            outfile.write("\n")
+        return template
+
+    def __repr__(self):
+        return "<FDICLayoutRegistry(path=%s)>" % self.path
+
+
+layouts = FDICLayoutRegistry()
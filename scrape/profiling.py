@@ -0,0 +1,152 @@
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class FDICProfiler():
+    """Opt-in per-stage profiling, and capture of slow filing pages as reproducible benchmark inputs.
+
+    Each stage has its own cProfile, and nested stages are exclusive: the outer stage's profile is
+    paused while an inner stage runs. instrument() hooks the standard stages into the scraper classes
+    and the SQLAlchemy session. Reports and slow pages are written under directory."""
+
+    def __init__(self, directory, slow_seconds=2.0):
+        self.directory = directory
+        self.slow_seconds = slow_seconds
+        self.slow_pages = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._wall_times = {}
+        self._calls = {}
+        self._instrumented = []
+
+    @contextmanager
+    def stage(self, name):
+        stack = self._get_stack()
+        if stack:
+            stack[-1].disable()
+
+        profile = self._get_profile(name)
+        stack.append(profile)
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1].enable()
+
+            with self._lock:
+                self._wall_times[name] = self._wall_times.get(name, 0.0) + elapsed
+                self._calls[name] = self._calls.get(name, 0) + 1
+
+    def instrument(self):
+        """Wrap the standard stages with stage(), until restore() is called"""
+        from sqlalchemy.orm import Session
+        from scrape.scrape_filers import FDICFilerScraper
+        from scrape.scrape_listing import FDICOwnFilingScraper
+        from scrape.scrape_trades import FDICInsiderFileScraper
+
+        self._wrap(FDICFilerScraper, "update", "filers.update")
+        self._wrap(FDICOwnFilingScraper, "update", "listings.update")
+        self._wrap(FDICInsiderFileScraper, "get_remote", "filings.get_remote")
+        self._wrap(FDICInsiderFileScraper, "update", "filings.update", after=self.check_page)
+        self._wrap(FDICInsiderFileScraper, "refresh", "filings.refresh", after=self.check_page)
+        self._wrap(Session, "commit", "commit")
+
+    def restore(self):
+        for cls, method_name, method in reversed(self._instrumented):
+            setattr(cls, method_name, method)
+        self._instrumented = []
+
+    def check_page(self, scraper):
+        """Save the HTML and timing breakdown of a filing page whose fetch, parse or load was slow"""
+        timings = getattr(scraper, "timings", None)
+        if not timings or not self.slow_seconds:
+            return
+        if max(timings.get("parse", 0), timings.get("load", 0), timings.get("fetch", 0)) < self.slow_seconds:
+            return
+
+        path = os.path.join(self.directory, "slow_pages")
+        os.makedirs(path, exist_ok=True)
+        # Named <disclosure_id>.html, so the directory can be replayed with "extract --dir"
+        with open(os.path.join(path, "%s.html" % scraper.disclosure_id), "w", encoding="utf-8") as outfile:
+            outfile.write(scraper.html or "")
+        with open(os.path.join(path, "%s.json" % scraper.disclosure_id), "w") as outfile:
+            json.dump({"url": scraper.url, "disclosure_id": scraper.disclosure_id, "timings": timings},
+                      outfile, indent=2)
+        with self._lock:
+            self.slow_pages += 1
+
+    def report(self, stream=sys.stderr, top=30):
+        """Write <stage>.prof and <stage>.txt for each stage, and a summary to stream"""
+        os.makedirs(self.directory, exist_ok=True)
+
+        stages = {}
+        for name, profile in self._profiles:
+            stages.setdefault(name, []).append(profile)
+
+        stream.write("%-24s %10s %12s\n" % ("stage", "calls", "seconds"))
+        for name in sorted(stages, key=lambda n: -self._wall_times.get(n, 0.0)):
+            stats = pstats.Stats(stages[name][0])
+            for profile in stages[name][1:]:
+                stats.add(profile)
+            stats.dump_stats(os.path.join(self.directory, "%s.prof" % name))
+            with open(os.path.join(self.directory, "%s.txt" % name), "w") as outfile:
+                stats.stream = outfile
+                stats.sort_stats("cumulative").print_stats(top)
+
+            stream.write("%-24s %10d %12.3f\n" % (name, self._calls.get(name, 0), self._wall_times.get(name, 0.0)))
+        if self.slow_pages:
+            stream.write("%d slow pages saved to %s\n" % (self.slow_pages, os.path.join(self.directory, "slow_pages")))
+
+    def _wrap(self, cls, method_name, stage_name, after=None):
+        method = getattr(cls, method_name)
+        profiler = self
+
+        @functools.wraps(method)
+        def wrapper(obj, *args, **kwargs):
+            with profiler.stage(stage_name):
+                result = method(obj, *args, **kwargs)
+            if after:
+                after(obj)
+            return result
+
+        self._instrumented.append((cls, method_name, method))
+        setattr(cls, method_name, wrapper)
+
+    def _get_stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+            self._local.profiles = {}
+        return self._local.stack
+
+    def _get_profile(self, name):
+        # Profiles are per thread, and merged by stage in report()
+        profile = self._local.profiles.get(name)
+        if profile is None:
+            profile = self._local.profiles[name] = cProfile.Profile()
+            with self._lock:
+                self._profiles.append((name, profile))
+        return profile
+
+    def __enter__(self):
+        self.instrument()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.restore()
+        self.report()
+
+    def __repr__(self):
+        return "<FDICProfiler(directory=%s)>" % self.directory
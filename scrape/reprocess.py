@@ -0,0 +1,111 @@
+from datetime import datetime
+from multiprocessing import Pool
+from scrape.scrape_trades import FDICInsiderFileScraper
+from storage.file_listing import FDICFiling
+from storage.fingerprints import FDICTransFingerprint
+from storage.footnotes import FDICNoteTerm
+from storage.insiders import FDICInsider
+from storage.partitions import FDICTransPartition
+from storage.sources import FDICTransSource
+from storage.transactions import (FDICTradeHandler, FDICTransFilerInfo, FDICTransFilingInfo,
+                                  FDICTransTrade, FDICTransNotes)
+
+# The table loaded from each list of normalized records
+RECORD_TABLES = (
+    ("issuer_info", FDICTransFilingInfo.__table__),
+    ("filer_info", FDICTransFilerInfo.__table__),
+    ("trades", FDICTransTrade.__table__),
+    ("notes", FDICTransNotes.__table__),
+)
+
+
+def reprocess_one(item):
+    """Re-derive one disclosure from its stored source, returning (disclosure_id, normalized, content_hash).
+    Failures are returned as (disclosure_id, None, error message)."""
+    disclosure_id, compression, source = item
+    try:
+        table_data = FDICInsiderFileScraper.parse_html(FDICTransSource.decompress(source, compression),
+                                                          disclosure_id)
+        normalized = FDICInsiderFileScraper.normalize(disclosure_id, table_data)
+        return disclosure_id, normalized, FDICInsiderFileScraper.hash_table_data(table_data)
+    except Exception as e:
+        return disclosure_id, None, "%s: %s" % (type(e).__name__, e)
+
+
+class FDICReprocessor():
+    """Re-derives issuer info, filer info, trades and notes from the stored sources in fdic_trans_sources,
+    parsing in worker processes, and replacing each disclosure's rows in its own transaction."""
+
+    def __init__(self, engine, processes=1, chunksize=8):
+        self.engine = engine
+        self.processes = processes
+        self.chunksize = chunksize
+        self.replaced = 0
+        self.errors = 0
+        self.dropped_rows = 0
+
+    def run(self, session, discl_ids=None, on_progress=None, on_error=None, on_dropped=None):
+        """Reprocess the disclosures in discl_ids (every stored source by default). on_dropped is called with
+        (disclosure_id, dropped_rows) for each disclosure that dropped rows not matching their column headers."""
+        if discl_ids is None:
+            discl_ids = FDICTransSource.get_local_discl(session)
+        sources = FDICTransSource.iter_sources(self.engine, list(discl_ids))
+
+        if self.processes > 1:
+            with Pool(self.processes) as pool:
+                self._load_all(session, pool.imap_unordered(reprocess_one, sources, self.chunksize),
+                               on_progress, on_error, on_dropped)
+        else:
+            self._load_all(session, map(reprocess_one, sources), on_progress, on_error, on_dropped)
+        return self.replaced
+
+    def _load_all(self, session, results, on_progress, on_error, on_dropped):
+        for disclosure_id, normalized, content_hash in results:
+            if normalized is None:
+                self.errors += 1
+                if on_error:
+                    on_error(disclosure_id, content_hash)
+                continue
+
+            try:
+                self.replace(session, normalized, content_hash)
+                session.commit()
+                self.replaced += 1
+                if normalized["dropped_rows"]:
+                    self.dropped_rows += sum(normalized["dropped_rows"].values())
+                    if on_dropped:
+                        on_dropped(disclosure_id, normalized["dropped_rows"])
+            except Exception as e:
+                session.rollback()
+                self.errors += 1
+                if on_error:
+                    on_error(disclosure_id, "%s: %s" % (type(e).__name__, e))
+
+            if on_progress:
+                on_progress(self.replaced + self.errors)
+
+    @classmethod
+    def replace(cls, session, normalized, content_hash):
+        """Replace a disclosure's rows with the normalized records, and update its fingerprint"""
+        disclosure_id = normalized["disclosure_id"]
+        FDICTradeHandler.delete_disclosure(session, disclosure_id)
+        for kind, table in RECORD_TABLES:
+            if normalized[kind]:
+                session.execute(table.insert(), [dict(record, disclosure_id=disclosure_id)
+                                                 for record in normalized[kind]])
+        # A compacted filing year keeps its re-derived rows in its archives
+        FDICTransPartition.archive_disclosure(session, disclosure_id)
+        FDICNoteTerm.reindex(session, disclosure_id,
+                             [(note["note_number"], note["footnote"]) for note in normalized["notes"]])
+        FDICInsider.index_disclosure(session, disclosure_id, normalized["filer_info"])
+
+        updated = session.query(FDICTransFingerprint).filter(
+            FDICTransFingerprint.disclosure_id == disclosure_id
+        ).update({"content_hash": content_hash, "changed_date": datetime.now()}, synchronize_session=False)
+        if not updated:
+            filing = session.query(FDICFiling).get(disclosure_id)
+            listing_hash = FDICTransFingerprint.hash_listing(filing) if filing else None
+            session.add(FDICTransFingerprint(disclosure_id, content_hash, listing_hash))
+
+    def __repr__(self):
+        return "<FDICReprocessor(processes=%d)>" % self.processes
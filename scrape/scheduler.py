@@ -0,0 +1,78 @@
+import heapq
+from collections import namedtuple
+from datetime import date, timedelta
+
+PendingFiling = namedtuple("PendingFiling", ["disclosure_id", "cert_number", "filing_date", "url"])
+
+
+class FDICFilingScheduler():
+    """Orders pending filing fetches so fresh filings are not stuck behind a long backfill.
+
+    Filings from the last fresh_days days go to a fresh queue, and older ones to a backfill queue.
+    Within each queue, filings for watch-listed certs come first (higher priority first), then the
+    newest filing dates. Iterating alternates between the queues so that fresh work gets fresh_share
+    of the fetches while both have work. The shares are counted from when both queues last had work,
+    so a period with only one queue busy does not earn the other a burst. Filings may be added while
+    iterating."""
+
+    def __init__(self, watch_list=None, fresh_days=7, fresh_share=0.75, today=None):
+        # Maps cert number to priority. Certs not on the watch list have priority 0.
+        self.watch_list = dict(watch_list or {})
+        self.fresh_share = fresh_share
+        self.fresh_days = fresh_days
+        # A fixed date to measure freshness from, or None for the date each filing is added
+        self.today = today
+        self.fresh_served = 0
+        self.backfill_served = 0
+        self._fresh = []
+        self._backfill = []
+
+    def add(self, filing):
+        """Queue a PendingFiling (or any object with the same attributes)"""
+        priority = self.watch_list.get(filing.cert_number, 0)
+        filing_date = filing.filing_date or date.min
+        # heapq pops the smallest key: highest priority, then newest date, then highest disclosure ID
+        key = (-priority, -filing_date.toordinal(), -filing.disclosure_id)
+        if filing.filing_date and filing.filing_date >= self.get_fresh_since():
+            heapq.heappush(self._fresh, (key, filing))
+        else:
+            heapq.heappush(self._backfill, (key, filing))
+
+    def get_fresh_since(self):
+        return (self.today or date.today()) - timedelta(days=self.fresh_days)
+
+    def add_all(self, filings):
+        for filing in filings:
+            self.add(filing)
+
+    def pop(self):
+        """Returns the next filing to fetch, or None when both queues are empty"""
+        if not self._fresh or not self._backfill:
+            # Only one queue has work, so start counting the shares again
+            self.fresh_served = self.backfill_served = 0
+        served = self.fresh_served + self.backfill_served
+        if self._fresh and (not self._backfill or self.fresh_served < self.fresh_share * (served + 1)):
+            self.fresh_served += 1
+            return heapq.heappop(self._fresh)[1]
+        elif self._backfill:
+            self.backfill_served += 1
+            return heapq.heappop(self._backfill)[1]
+
+    @classmethod
+    def parse_watch_list(cls, values):
+        """Returns a watch list dict from CERT or CERT:PRIORITY strings (priority defaults to 1)"""
+        watch_list = {}
+        for value in values or []:
+            cert, _, priority = str(value).partition(":")
+            watch_list[int(cert)] = int(priority) if priority else 1
+        return watch_list
+
+    def __iter__(self):
+        while len(self):
+            yield self.pop()
+
+    def __len__(self):
+        return len(self._fresh) + len(self._backfill)
+
+    def __repr__(self):
+        return "<FDICFilingScheduler(fresh=%d, backfill=%d)>" % (len(self._fresh), len(self._backfill))
@@ -1,18 +1,19 @@
 import lxml.html
 import requests
 from sqlalchemy.exc import UnboundExecutionError
-from storage.filers import FDICFiler
+from storage.filers import filer_upsert
 from scrape.scraper import FDICScraper
 
 
 class FDICFilerScraper():
 
-    def __init__(self):
-        self.existing_certs = []
+    def __init__(self, http=None):
+        # A requests.Session to reuse connections (defaults to the requests module)
+        self.http = http
 
     def get_remote(self):
         # Request the page
-        req = requests.get("http://www.fdic.gov/bank/individual/part335/index.html")
+        req = (self.http or requests).get("http://www.fdic.gov/bank/individual/part335/index.html")
         tree = lxml.html.fromstring(req.text)
 
         # Parse headers from the HTML table
@@ -36,23 +37,23 @@ class FDICFilerScraper():
         return filers
 
     def _insert_new(self, session, filers):
-        if not self.existing_certs:
-            self.existing_certs = FDICFiler.get_local(session)
-
-        # Insert new FDIC filers results in the DB
+        # Upsert every scraped filer in one batch, inserting new filers and updating changed names and cities
+        rows = []
         for f in filers:
-            if eval(f.get("Cert Number")) not in self.existing_certs:
-                filer = FDICFiler(
-                    f.get("Cert Number"),
-                    f.get("Bank Name"),
-                    f.get("City"),
-                    f.get("State")
-                )
-
-                try:
-                    session.add(filer)
-                except UnboundExecutionError as e:
-                    print(e)
+            try:
+                rows.append({
+                    "cert_number": int(f.get("Cert Number")),
+                    "bank_name": f.get("Bank Name"),
+                    "city": f.get("City"),
+                    "state": f.get("State")
+                })
+            except (TypeError, ValueError) as e:
+                print(e)
+
+        try:
+            filer_upsert.upsert(session, rows)
+        except UnboundExecutionError as e:
+            print(e)
 
     def __repr__(self):
         return "<FDICFilerScraper()>"
\ No newline at end of file
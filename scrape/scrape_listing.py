@@ -2,22 +2,27 @@ from urllib.parse import urlparse, parse_qs
 import lxml.html
 import requests
 from sqlalchemy.exc import UnboundExecutionError
-from storage.file_listing import FDICFiling
+from scrape.scheduler import PendingFiling
+from storage.file_listing import FDICFiling, filing_upsert
+from storage.normalize import FDICRowNormalizer
 
 
 class FDICOwnFilingScraper():
 
     BASE_URL = 'http://www2.fdic.gov/efr/instdetail.asp'
 
-    def __init__(self):
-        self.existing_filings = []
-        self.new_filings = []
+    def __init__(self, batch_size=1, http=None):
+        # Number of file listing rows staged before each upsert. Call flush() after the last update().
+        self.batch_size = batch_size
+        # A requests.Session to reuse connections across certs (defaults to the requests module)
+        self.http = http
+        self.pending_filings = []
 
     def get_remote(self, cert_number):
         """Return a dict containing the file listing table for the given cert number"""
         payload = {'CertNum': str(cert_number),
                    'CertNum_INTEGER': 'The FDIC Certificate Number must req.,be a positive integer'}
-        req = requests.post(FDICOwnFilingScraper.BASE_URL, params=payload)
+        req = (self.http or requests).post(FDICOwnFilingScraper.BASE_URL, params=payload)
         tree = lxml.html.fromstring(req.text, base_url=FDICOwnFilingScraper.BASE_URL)
         tree.make_links_absolute()
 
@@ -63,29 +68,34 @@ class FDICOwnFilingScraper():
         return filings
 
     def _insert_new(self, session, filings, cert):
-        if not self.existing_filings:
-            self.existing_filings = [f.disclosure_id for f in FDICFiling.get_local(session)]
-
-        # For new files, create FDICFiling objects for insertion into the DB.
+        # Stage every listed file. The upsert inserts new files, and carries over corrected listing
+        # metadata for existing ones, so revalidation can spot republished filings.
         for file in filings:
             try:
-                if eval(file.get("Disclosure ID")) not in self.existing_filings:
-                    self.new_filings.append(file)
-                    filing = FDICFiling(
-                        cert, file.get("Last Name"), file.get("First Name"),
-                        file.get("Middle Initial"), file.get("Form Name"),
-                        file.get("Filing Date"), file.get("Disclosure ID"),
-                        file.get("URL")
-                    )
-
-                    try:
-                        session.add(filing)
-                    except UnboundExecutionError as e:
-                        print(e)
-
-            except TypeError as e:
+                self.pending_filings.append({
+                    "disclosure_id": int(file.get("Disclosure ID")),
+                    "cert_number": int(cert),
+                    "last_name": file.get("Last Name"),
+                    "first_name": file.get("First Name"),
+                    "middle": file.get("Middle Initial"),
+                    "form_type": file.get("Form Name"),
+                    "filing_date": FDICRowNormalizer.parse_date(file.get("Filing Date")),
+                    "url": file.get("URL")
+                })
+            except (TypeError, ValueError) as e:
                 print(e)
 
+        if len(self.pending_filings) >= self.batch_size:
+            self.flush(session)
+
+    def flush(self, session):
+        """Upsert the staged file listings"""
+        try:
+            filing_upsert.upsert(session, self.pending_filings)
+        except UnboundExecutionError as e:
+            print(e)
+        self.pending_filings = []
+
     @classmethod
     def parse_url_discl_id(cls, url):
         """Returns the discl_id parameter from an input URL"""
@@ -109,8 +119,15 @@ class FDICOwnFilingScraper():
     @classmethod
     def get_new_urls(cls, session, discl_ids):
         """Returns a list of URLs from discl_ids that do not already exist in the DB."""
-        local_discl = FDICFiling.get_local(session)
-        return [file.url for file in local_discl if file.disclosure_id not in discl_ids]
+        return [filing.url for filing in FDICOwnFilingScraper.get_new_filings(session, discl_ids)]
+
+    @classmethod
+    def get_new_filings(cls, session, discl_ids):
+        """Returns a list of PendingFilings for the file listings whose disclosure_id is not in discl_ids."""
+        discl_ids = set(discl_ids)
+        results = session.query(FDICFiling.disclosure_id, FDICFiling.cert_number,
+                                FDICFiling.filing_date, FDICFiling.url)
+        return [PendingFiling(*row) for row in results if row.disclosure_id not in discl_ids]
 
     def __repr__(self):
         return "<FDICOwnFilingScraper(cert)>"
\ No newline at end of file
@@ -1,7 +1,19 @@
+from datetime import datetime
+import time
 import lxml.html
 import requests
+from scrape.layouts import layouts
 from scrape.scrape_listing import FDICOwnFilingScraper
-from storage.transactions import FDICTransFilerInfo, FDICTransFilingInfo, FDICTransTrade, FDICTransNotes
+from storage.file_listing import FDICFiling
+from storage.fingerprints import FDICTransFingerprint
+from storage.footnotes import FDICNoteTerm
+from storage.insiders import FDICInsider
+from storage.normalize import FDICRowNormalizer
+from storage.partitions import FDICTransPartition
+from storage.sources import FDICTransSource
+from storage.sqlsession import hold_checkpoints
+from storage.transactions import (FDICTradeHandler, FDICTransFilerInfo, FDICTransFilingInfo,
+                                  FDICTransTrade, FDICTransNotes)
 
 
 def test_scrape():
@@ -35,64 +47,225 @@ class FDICInsiderFileScraper():
     def get_existing_dicl(cls, session):
         return FDICTransTrade.get_local_discl(session)
 
-    def __init__(self, url):
+    def __init__(self, url, http=None):
         self.url = url
+        # A requests.Session to reuse connections across filings (defaults to the requests module)
+        self.http = http
         self.disclosure_id = FDICOwnFilingScraper.parse_url_discl_id(url)
         self.cert_number = FDICOwnFilingScraper.parse_url_certnum(url)
         self.table_data = None
+        self.html = None
+        # Seconds spent fetching, parsing and loading this filing
+        self.timings = {}
 
-    def update(self, session):
+    def update(self, session, writer=None):
+        """Fetch the filing and add its rows to session, or queue them on writer (an FDICBackgroundWriter)"""
         self.get_remote()
         #print(self.url)
 
-        section = self.table_data.get("Filing Information")
+        start = time.perf_counter()
+        records = self.get_records()
+        # Index the footnotes as they are loaded, so the footnote search stays current
+        records += FDICNoteTerm.get_records(self.disclosure_id, self._get_notes(records))
+        content_hash = self.content_hash()
+        source = FDICTransSource(self.disclosure_id, self.html)
+
+        # The fingerprint and source are merged, in case an earlier load of this disclosure stored no
+        # filer or issuer info
+        # Insiders are matched in the same session (and transaction) that loads the filer info
+        filer_infos = [record for record in records if isinstance(record, FDICTransFilerInfo)]
+        if writer is None:
+            with hold_checkpoints(session):
+                session.add_all(records)
+                session.merge(FDICTransFingerprint(self.disclosure_id, content_hash, self._listing_hash(session)))
+                session.merge(source)
+                FDICInsider.index_disclosure(session, self.disclosure_id, filer_infos)
+                FDICTransPartition.archive_disclosure(session, self.disclosure_id)
+        else:
+            # The listing hash is read by the writer, so this thread never waits on the DB
+            writer.put(records, merge=[source], after=[
+                lambda writer_session: writer_session.merge(FDICTransFingerprint(
+                    self.disclosure_id, content_hash, self._listing_hash(writer_session))),
+                lambda writer_session: FDICInsider.index_disclosure(writer_session, self.disclosure_id, filer_infos),
+                lambda writer_session: FDICTransPartition.archive_disclosure(writer_session, self.disclosure_id)
+            ])
+        self.timings["load"] = time.perf_counter() - start
+
+    def refresh(self, session, fingerprint=None):
+        """Re-fetch the filing, and replace its rows only if the content hash differs from fingerprint.
+        Returns True when the rows were replaced. The caller commits, so each replacement is one transaction."""
+        self.get_remote()
+        with hold_checkpoints(session):
+            return self._refresh(session, fingerprint)
+
+    def _refresh(self, session, fingerprint):
+        content_hash = self.content_hash()
+        listing_hash = self._listing_hash(session)
+        session.merge(FDICTransSource(self.disclosure_id, self.html))
+
+        # An earlier checkpoint may have detached the caller's fingerprint, so update the attached one
+        if fingerprint is not None:
+            fingerprint = session.query(FDICTransFingerprint).get(self.disclosure_id)
+
+        if fingerprint is not None and fingerprint.content_hash == content_hash:
+            fingerprint.listing_hash = listing_hash
+            fingerprint.checked_date = datetime.now()
+            return False
+
+        FDICTradeHandler.delete_disclosure(session, self.disclosure_id)
+        records = self.get_records()
+        session.add_all(records)
+        # A compacted filing year keeps its replaced rows in its archives
+        FDICTransPartition.archive_disclosure(session, self.disclosure_id)
+        FDICNoteTerm.reindex(session, self.disclosure_id, self._get_notes(records))
+        FDICInsider.index_disclosure(session, self.disclosure_id,
+                                     [record for record in records if isinstance(record, FDICTransFilerInfo)])
+        if fingerprint is None:
+            session.add(FDICTransFingerprint(self.disclosure_id, content_hash, listing_hash))
+        else:
+            fingerprint.content_hash = content_hash
+            fingerprint.listing_hash = listing_hash
+            fingerprint.checked_date = fingerprint.changed_date = datetime.now()
+        return True
+
+    def get_dropped_rows(self):
+        """Returns the number of rows dropped from each section of the parsed page, for not matching its headers"""
+        return (self.table_data or {}).get("Dropped Rows") or {}
+
+    @classmethod
+    def describe_dropped_rows(cls, dropped):
+        return ", ".join("%s (%d)" % item for item in sorted(dropped.items()))
+
+    def get_records(self):
+        """Returns the ORM objects for the rows of the parsed table data"""
+        records = []
+        template = layouts.get(self.table_data.get("Layout"))
+        for kind, number, row, derivative in FDICInsiderFileScraper.iter_records(self.table_data):
+            columns = template.get_columns(kind, derivative) if template else None
+            if kind == "issuer_info":
+                records.append(FDICTransFilingInfo(self.disclosure_id, number, row, columns))
+            elif kind == "filer_info":
+                records.append(FDICTransFilerInfo(self.disclosure_id, number, row, columns))
+            elif kind == "trades":
+                records.append(FDICTransTrade(self.disclosure_id, number, row, derivative=derivative, columns=columns))
+            elif kind == "notes":
+                records.append(FDICTransNotes(self.disclosure_id, number, row))
+        return records
+
+    @classmethod
+    def _get_notes(cls, records):
+        return [(record.note_number, record.footnote) for record in records if isinstance(record, FDICTransNotes)]
+
+    def content_hash(self):
+        return FDICInsiderFileScraper.hash_table_data(self.table_data)
+
+    @classmethod
+    def hash_table_data(cls, table_data):
+        """Returns a hash of the parsed sections, which changes only when the stored rows would change"""
+        records = list(FDICInsiderFileScraper.iter_records(table_data))
+        return FDICTransFingerprint.hash_content([records, table_data.get("Exit Filing")])
+
+    def _listing_hash(self, session):
+        filing = session.query(FDICFiling).get(int(self.disclosure_id))
+        return FDICTransFingerprint.hash_listing(filing) if filing else None
+
+    def get_remote(self):
+        start = time.perf_counter()
+        self.html = FDICInsiderFileScraper.fetch(self.url, self.http)
+        fetched = time.perf_counter()
+        self.table_data = FDICInsiderFileScraper.parse_html(self.html, self.url)
+
+        self.timings["fetch"] = fetched - start
+        self.timings["parse"] = time.perf_counter() - fetched
+
+    @classmethod
+    def iter_records(cls, table_data):
+        """Yields (kind, number, row, derivative) for each row of the parsed table data that should be stored"""
+        section = table_data.get("Filing Information")
         if section:
             for i, row in enumerate(section):
-                session.add(FDICTransFilingInfo(self.disclosure_id, i + 1, row))
+                yield "issuer_info", i + 1, row, False
 
-        section = self.table_data.get("Filer Information")
+        section = table_data.get("Filer Information")
         if section:
             for i, row in enumerate(section):
-                session.add(FDICTransFilerInfo(self.disclosure_id, i + 1, row))
+                yield "filer_info", i + 1, row, False
 
-        section = self.table_data.get("Table I - Non-Derivative")
+        section = table_data.get("Table I - Non-Derivative")
         row_counter = 0
         if section:
             for i, row in enumerate(section):
                 if row and 'There are no' not in row:  # Skip blank entries
                     row_counter += 1
-                    session.add(FDICTransTrade(self.disclosure_id, row_counter, row))
+                    yield "trades", row_counter, row, False
 
         # row_counter continues between Table I and Table II
-        section = self.table_data.get("Table II - Derivative")
+        section = table_data.get("Table II - Derivative")
         if section:
             for i, row in enumerate(section):
                 if row and 'There are no' not in row:  # Skip blank entries
                     row_counter += 1
-                    session.add(FDICTransTrade(self.disclosure_id, row_counter, row, derivative=True))
+                    yield "trades", row_counter, row, True
 
         # Reset row_counter for notes
         row_counter = 0
-        section = self.table_data.get("Explanation of Responses")
+        section = table_data.get("Explanation of Responses")
         # Exclude last 2 Explanation rows.
         # These 2 lines are always: 1) signature line and 2) junk legalese
-        if section[0:-2]:
+        if section and section[0:-2]:
             for i, row in enumerate(section[0:-2]):
                 if row:  # Skip blank entries
                     row_counter += 1
-                    session.add(FDICTransNotes(self.disclosure_id, row_counter, row))
+                    yield "notes", row_counter, row, False
 
-    def get_remote(self):
-        self.table_data = self._parse_table(self.url)
+    @classmethod
+    def normalize(cls, disclosure_id, table_data):
+        """Returns a dict of the normalized column values for every stored row in the parsed table data"""
+        disclosure = {
+            "disclosure_id": int(disclosure_id),
+            "exit_filing": table_data.get("Exit Filing"),
+            "issuer_info": [],
+            "filer_info": [],
+            "trades": [],
+            "notes": [],
+            # The number of rows dropped from each section, for not matching its column headers
+            "dropped_rows": table_data.get("Dropped Rows") or {}
+        }
+
+        # Known layouts use their precompiled template, and others match columns row by row
+        template = layouts.get(table_data.get("Layout"))
+        for kind, number, row, derivative in cls.iter_records(table_data):
+            columns = template.get_columns(kind, derivative) if template else None
+            if kind == "issuer_info":
+                record = dict(info_number=number, **FDICRowNormalizer.issuer_info(row, columns))
+            elif kind == "filer_info":
+                record = dict(info_number=number, **FDICRowNormalizer.filer_info(row, columns))
+            elif kind == "trades":
+                record = dict(trade_number=number, **FDICRowNormalizer.trade(row, derivative, columns))
+            else:
+                record = dict(note_number=number, **FDICRowNormalizer.note(row))
+            disclosure[kind].append(record)
+
+        return disclosure
 
     @classmethod
-    def _parse_table(cls, url):
-        req = requests.get(url)
+    def fetch(cls, url, http=None):
+        """Returns the HTML text of the filing at url, requested with http (a requests.Session) if given"""
+        req = (http or requests).get(url)
         if req.ok:
-            tree = lxml.html.fromstring(req.text)
+            return req.text
         else:
             raise requests.ConnectionError
 
+    @classmethod
+    def _parse_table(cls, url):
+        return FDICInsiderFileScraper.parse_html(FDICInsiderFileScraper.fetch(url))
+
+    @classmethod
+    def parse_html(cls, html, source=None):
+        """Returns the parsed sections of a filing page. source (e.g. its URL) is noted if the layout is unknown."""
+        tree = lxml.html.fromstring(html)
+
         # List of rows (TR elements) inside the relevant table
         table_rows = FDICInsiderFileScraper._get_table_rows(tree)
 
@@ -100,6 +273,10 @@ class FDICInsiderFileScraper():
         section_index = FDICInsiderFileScraper._index_sections(table_rows, FDICInsiderFileScraper.SECTIONS)
 
         table_data = {}
+        # The column headers of each labelled section, which identify the page layout
+        headers = {}
+        # The number of rows dropped from each labelled section, for not matching its column headers
+        dropped = {}
         # Compose data for each section from the range of relevant rows in section_index
         for i in range(len(FDICInsiderFileScraper.SECTIONS)-1):
             # Relevant rows range from this section's to the next section's row index
@@ -108,9 +285,13 @@ class FDICInsiderFileScraper():
 
             # Returns list, list of dicts, or None for this section
             table_data[FDICInsiderFileScraper.SECTIONS[i]] = (
-                FDICInsiderFileScraper._compose_section(table_rows[start: end])
+                FDICInsiderFileScraper._compose_section(table_rows[start: end], headers,
+                                                        FDICInsiderFileScraper.SECTIONS[i], dropped)
             )
 
+        table_data['Layout'] = layouts.match(headers, source)
+        table_data['Dropped Rows'] = dropped
+
         # Determine whether the exit filing indicator is checked
         table_data['Exit Filing'] = FDICInsiderFileScraper._pull_exit_checkbox(table_rows)
 
@@ -159,7 +340,7 @@ class FDICInsiderFileScraper():
         return ' '.join(element.xpath('.//text()'))
 
     @classmethod
-    def _compose_section(cls, rows):
+    def _compose_section(cls, rows, layout=None, section=None, dropped=None):
         # The first row is the section header, and is not needed.
         if rows:
             rows.pop(0)
@@ -168,8 +349,13 @@ class FDICInsiderFileScraper():
         headers = FDICInsiderFileScraper._get_column_headers(rows, 'th')
 
         if headers:
+            if layout is not None:
+                layout[section] = headers
             # Returns a list of dicts pairing each datum with its header
-            return FDICInsiderFileScraper._compose_labelled(headers, rows)
+            labelled, mismatched = FDICInsiderFileScraper._compose_labelled(headers, rows)
+            if mismatched and dropped is not None:
+                dropped[section] = mismatched
+            return labelled
         else:
             # Returns a plain list, since there are no column headers for pairing
             return FDICInsiderFileScraper._compose_unlabelled(rows)
@@ -187,15 +373,20 @@ class FDICInsiderFileScraper():
 
     @classmethod
     def _compose_labelled(cls, headers, rows):
+        # Returns the rows paired with their headers, and the number of rows that could not be paired
         section = []
+        mismatched = 0
         for i, row in enumerate(rows):
             one_row = FDICInsiderFileScraper._get_row_contents(row, 'td')
             if one_row:
                 if len(one_row) == len(headers):
                     section.append(dict(zip(headers, one_row)))
+                elif len(one_row) > 1:
+                    # Single cells are notes within the section, such as the exit filing checkbox
+                    mismatched += 1
             else:
                 pass  # Nothing to append
-        return section
+        return section, mismatched
 
     @classmethod
     def _compose_unlabelled(cls, rows):
@@ -7,6 +7,7 @@ setup(
     name='fdic_trans',
     version='0.1',
     packages=['storage', 'scrape'],
+    package_data={'scrape': ['layouts.json']},
     url='',
     license='',
     author='Sean Herman',
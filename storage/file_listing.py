@@ -1,5 +1,6 @@
 from sqlalchemy import Column, Integer, String, ForeignKey, Date
 from storage.sqlsession import Base
+from storage.staging import FDICStagingUpsert
 
 
 class FDICFiling(Base):
@@ -14,6 +15,9 @@ class FDICFiling(Base):
     filing_date = Column(Date)
     url = Column(String(200))
 
+    # Columns taken from the FDIC file listing, which may be corrected when a filing is republished
+    LISTING_COLUMNS = ("cert_number", "last_name", "first_name", "middle", "form_type", "filing_date", "url")
+
     """ Returns a list of disclosure_ids that already exist on the database."""
     @classmethod
     def get_local(cls, session):
@@ -36,4 +40,8 @@ class FDICFiling(Base):
                 "url='%s')>") % (
                 self.cert_number, self.last_name, self.first_name,self.middle, self.form_type,
                 self.filing_date, self.disclosure_id, self.url
-        )
\ No newline at end of file
+        )
+
+
+# Upserts scraped file listings through the fdic_filings_staging table
+filing_upsert = FDICStagingUpsert(FDICFiling)
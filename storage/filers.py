@@ -1,6 +1,7 @@
 from sqlalchemy import Column, Integer, String
 from sqlalchemy.orm import relationship
 from storage.sqlsession import Base
+from storage.staging import FDICStagingUpsert
 
 
 class FDICFiler(Base):
@@ -15,11 +16,11 @@ class FDICFiler(Base):
     """ Returns a list of cert_numbers that already exist on the database."""
     @classmethod
     def get_local(cls, session):
-        results = session.query(FDICFiler)
-        return [r.cert_number for r in results]
+        results = session.query(FDICFiler.cert_number)
+        return [cert_number for (cert_number,) in results]
 
     def __init__(self, cert_number, bank_name, city, state):
-        self.cert_number = eval(cert_number)
+        self.cert_number = int(cert_number)
         self.bank_name = bank_name
         self.city = city
         self.state = state
@@ -27,4 +28,8 @@ class FDICFiler(Base):
     def __repr__(self):
         return "<FDIC_Filer(cert_number=%d, bank_name='%s', city='%s', state='%s')>" % (
             self.cert_number, self.bank_name, self.city, self.state
-        )
\ No newline at end of file
+        )
+
+
+# Upserts scraped filers through the fdic_filers_staging table
+filer_upsert = FDICStagingUpsert(FDICFiler)
@@ -0,0 +1,64 @@
+import hashlib
+import json
+from datetime import date, datetime, timedelta
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from storage.sqlsession import Base
+from storage.file_listing import FDICFiling
+
+
+class FDICTransFingerprint(Base):
+    __tablename__ = 'fdic_trans_fingerprints'
+
+    disclosure_id = Column(Integer, ForeignKey("fdic_filings.disclosure_id"), primary_key=True)
+    content_hash = Column(String(64))
+    listing_hash = Column(String(64))
+    checked_date = Column(DateTime)
+    changed_date = Column(DateTime)
+
+    @classmethod
+    def hash_content(cls, sections):
+        """Returns a hash of a disclosure's parsed sections. Keys are sorted, so column order does not matter."""
+        content = json.dumps(sections, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def hash_listing(cls, filing):
+        """Returns a hash of the file listing metadata for an FDICFiling"""
+        listing = [getattr(filing, column) for column in FDICFiling.LISTING_COLUMNS]
+        content = json.dumps(listing, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get_candidates(cls, session, discl_ids, recency_days=30, include_all=False):
+        """Returns (filing, fingerprint) pairs for loaded disclosures that are due for revalidation.
+
+        A loaded disclosure (i.e., in discl_ids) is due when its listing metadata changed since it
+        was fingerprinted, when it was filed within the last recency_days, or always with include_all.
+        The fingerprint is None for disclosures loaded before fingerprints were recorded."""
+        discl_ids = set(discl_ids)
+        since = date.today() - timedelta(days=recency_days)
+
+        results = session.query(FDICFiling, FDICTransFingerprint).outerjoin(
+            FDICTransFingerprint, FDICFiling.disclosure_id == FDICTransFingerprint.disclosure_id
+        )
+
+        candidates = []
+        for filing, fingerprint in results:
+            if filing.disclosure_id not in discl_ids:
+                continue
+            if include_all or (filing.filing_date and filing.filing_date >= since):
+                candidates.append((filing, fingerprint))
+            elif fingerprint and fingerprint.listing_hash != FDICTransFingerprint.hash_listing(filing):
+                candidates.append((filing, fingerprint))
+        return candidates
+
+    def __init__(self, disclosure_id, content_hash, listing_hash):
+        self.disclosure_id = int(disclosure_id)
+        self.content_hash = content_hash
+        self.listing_hash = listing_hash
+        self.checked_date = self.changed_date = datetime.now()
+
+    def __repr__(self):
+        return "<FDICTransFingerprint(disclosure_id=%d, content_hash='%s')>" % (
+            self.disclosure_id, self.content_hash
+        )
@@ -0,0 +1,183 @@
+import math
+import re
+from collections import Counter, namedtuple
+from sqlalchemy import Column, Integer, String, ForeignKey, select, or_, func
+from storage.sqlsession import Base
+from storage.partitions import FDICTransPartition
+from storage.transactions import FDICTransNotes
+
+FootnoteMatch = namedtuple("FootnoteMatch", ["disclosure_id", "score", "highlights"])
+
+
+class FDICNoteTerm(Base):
+    """An inverted index over fdic_trans_notes: one row per distinct term in each footnote.
+
+    Searches look up the postings for each query term through the term index, rather than scanning
+    every footnote with LIKE '%...%'. A disclosure's terms are replaced whenever its notes are
+    (re)loaded, so the index is maintained incrementally. It uses plain tables and indexes, so it
+    works the same on SQL Server, PostgreSQL and SQLite."""
+    __tablename__ = 'fdic_trans_note_terms'
+
+    id = Column(Integer, primary_key=True)
+    term = Column(String(50), nullable=False, index=True)
+    disclosure_id = Column(Integer, ForeignKey("fdic_filings.disclosure_id"), nullable=False, index=True)
+    note_number = Column(Integer)
+    frequency = Column(Integer)
+
+    # Words, numbers, and hyphenated terms such as "10b5-1"
+    TERM_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+    STOP_WORDS = frozenset(("a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+                            "of", "on", "or", "such", "that", "the", "this", "to", "was", "were", "which", "with"))
+
+    @classmethod
+    def tokenize(cls, text):
+        """Returns the indexed terms of text, in order"""
+        return [term for term in FDICNoteTerm.TERM_PATTERN.findall((text or "").lower())
+                if term not in FDICNoteTerm.STOP_WORDS and len(term) <= 50]
+
+    @classmethod
+    def get_postings(cls, disclosure_id, notes):
+        """Returns a dict per distinct term of each (note_number, footnote) pair, keyed by column name"""
+        postings = []
+        for note_number, footnote in notes:
+            for term, frequency in Counter(FDICNoteTerm.tokenize(footnote)).items():
+                postings.append({"term": term, "disclosure_id": int(disclosure_id),
+                                 "note_number": note_number, "frequency": frequency})
+        return postings
+
+    @classmethod
+    def get_records(cls, disclosure_id, notes):
+        """Returns the ORM objects indexing a newly loaded disclosure's (note_number, footnote) pairs"""
+        return [FDICNoteTerm(**posting) for posting in FDICNoteTerm.get_postings(disclosure_id, notes)]
+
+    @classmethod
+    def reindex(cls, session, disclosure_id, notes):
+        """Replace the indexed terms for a disclosure with those of its (note_number, footnote) pairs"""
+        session.query(FDICNoteTerm).filter(FDICNoteTerm.disclosure_id == int(disclosure_id)).delete(
+            synchronize_session=False)
+        postings = FDICNoteTerm.get_postings(disclosure_id, notes)
+        if postings:
+            session.execute(FDICNoteTerm.__table__.insert(), postings)
+
+    @classmethod
+    def rebuild(cls, session, chunk_size=1000, on_progress=None):
+        """Re-index every loaded footnote, committing after each chunk of disclosures"""
+        # Notes of compacted filing years are read from their archives too
+        notes_table = FDICTransPartition.get_union(session, FDICTransNotes.__table__)
+        discl_ids = [disclosure_id for (disclosure_id,) in session.execute(
+            select(notes_table.c.disclosure_id).distinct().order_by(notes_table.c.disclosure_id))]
+        for i in range(0, len(discl_ids), chunk_size):
+            chunk = discl_ids[i:i + chunk_size]
+            notes = {disclosure_id: [] for disclosure_id in chunk}
+            for disclosure_id, note_number, footnote in session.execute(select(
+                    notes_table.c.disclosure_id, notes_table.c.note_number, notes_table.c.footnote
+            ).where(notes_table.c.disclosure_id.in_(chunk))):
+                notes[disclosure_id].append((note_number, footnote))
+
+            for disclosure_id in chunk:
+                FDICNoteTerm.reindex(session, disclosure_id, notes[disclosure_id])
+            session.commit()
+            if on_progress:
+                on_progress(i + len(chunk))
+        return len(discl_ids)
+
+    @classmethod
+    def parse_query(cls, query):
+        """Returns the (terms, prefixes, phrases) of a query. Every term and prefix (e.g. pledg*) must match,
+        and each "quoted phrase" must appear verbatim in the same footnote."""
+        phrases = [" ".join(phrase.lower().split()) for phrase in re.findall(r'"([^"]+)"', query)]
+        prefixes = FDICNoteTerm.tokenize(" ".join(re.findall(r"([\w'-]+)\*", query)))
+        terms = FDICNoteTerm.tokenize(re.sub(r"[\w'-]+\*", " ", query))
+        return list(dict.fromkeys(terms)), list(dict.fromkeys(prefixes)), phrases
+
+    @classmethod
+    def search(cls, session, query, limit=20, width=60):
+        """Returns up to limit FootnoteMatch tuples, best first, for the disclosures whose footnotes match query.
+
+        Notes are ranked by tf-idf over the query terms, and each disclosure scores the sum of its
+        matching notes. highlights has a snippet of each matching note, with the matches in [brackets]."""
+        terms, prefixes, phrases = FDICNoteTerm.parse_query(query)
+        keys = terms + [prefix + "*" for prefix in prefixes]
+        if not keys:
+            return []
+
+        table = FDICNoteTerm.__table__
+        conditions = []
+        if terms:
+            conditions.append(table.c.term.in_(terms))
+        for prefix in prefixes:
+            # Terms hold only letters, digits, hyphens and apostrophes, so prefixes need no escaping
+            conditions.append(table.c.term.like(prefix + "%"))
+
+        # Collect the term frequencies of each note that matches any query term
+        notes = {}
+        for disclosure_id, note_number, term, frequency in session.execute(
+                select(table.c.disclosure_id, table.c.note_number, table.c.term, table.c.frequency).where(
+                    or_(*conditions))):
+            # A term counts toward every query key it satisfies, e.g. "gifted" for both gifted and gif*
+            matched = notes.setdefault((disclosure_id, note_number), {})
+            for key in ([term] if term in terms else []) + [prefix + "*" for prefix in prefixes
+                                                            if term.startswith(prefix)]:
+                matched[key] = matched.get(key, 0) + frequency
+
+        # Rank the notes that match every query term
+        notes_table = FDICTransPartition.get_union(session, FDICTransNotes.__table__)
+        total_notes = session.execute(select(func.count(notes_table.c.id))).scalar() or 1
+        doc_freq = Counter(key for matched in notes.values() for key in matched)
+        scores = {}
+        for (disclosure_id, note_number), matched in notes.items():
+            if len(matched) == len(keys):
+                score = sum((1 + math.log(matched[key])) * math.log(1 + total_notes / doc_freq[key]) for key in keys)
+                scores.setdefault(disclosure_id, {})[note_number] = score
+        ranked = sorted(scores, key=lambda disclosure_id: -sum(scores[disclosure_id].values()))
+
+        # Fetch the footnotes of the best disclosures, to check phrases and compose highlights
+        pattern = FDICNoteTerm.get_highlight_pattern(terms, prefixes, phrases)
+        results = []
+        for i in range(0, len(ranked), limit):
+            chunk = ranked[i:i + limit]
+            texts = {}
+            for disclosure_id, note_number, footnote in session.execute(select(
+                    notes_table.c.disclosure_id, notes_table.c.note_number, notes_table.c.footnote
+            ).where(notes_table.c.disclosure_id.in_(chunk))):
+                if note_number in scores[disclosure_id]:
+                    texts.setdefault(disclosure_id, []).append((note_number, footnote or ""))
+
+            for disclosure_id in chunk:
+                matching = [(note_number, footnote) for note_number, footnote in sorted(texts.get(disclosure_id, []))
+                            if all(phrase in " ".join(footnote.lower().split()) for phrase in phrases)]
+                if matching:
+                    score = sum(scores[disclosure_id][note_number] for note_number, footnote in matching)
+                    highlights = [FDICNoteTerm.highlight(footnote, pattern, width) for note_number, footnote in matching]
+                    results.append(FootnoteMatch(disclosure_id, round(score, 4), highlights))
+            if len(results) >= limit:
+                break
+
+        return sorted(results, key=lambda match: -match.score)[:limit]
+
+    @classmethod
+    def get_highlight_pattern(cls, terms, prefixes, phrases):
+        parts = [r"\s+".join(re.escape(word) for word in phrase.split()) for phrase in phrases]
+        parts += [re.escape(term) for term in terms]
+        parts += [re.escape(prefix) + r"[\w'-]*" for prefix in prefixes]
+        return re.compile(r"(?<![\w])(%s)(?![\w])" % "|".join(parts), re.IGNORECASE)
+
+    @classmethod
+    def highlight(cls, footnote, pattern, width=60):
+        """Returns a snippet of footnote around its first match, with each match in [brackets]"""
+        first = pattern.search(footnote)
+        start = max(first.start() - width, 0) if first else 0
+        end = min((first.end() if first else 0) + width, len(footnote))
+        snippet = pattern.sub(lambda match: "[%s]" % match.group(0), footnote[start:end])
+        return ("..." if start > 0 else "") + snippet + ("..." if end < len(footnote) else "")
+
+    def __init__(self, term, disclosure_id, note_number, frequency):
+        self.term = term
+        self.disclosure_id = int(disclosure_id)
+        self.note_number = note_number
+        self.frequency = frequency
+
+    def __repr__(self):
+        return "<FDICNoteTerm(term='%s', disclosure_id=%d, note_number=%d)>" % (
+            self.term, self.disclosure_id, self.note_number
+        )
@@ -0,0 +1,174 @@
+import re
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from storage.sqlsession import Base
+from storage.file_listing import FDICFiling
+from storage.transactions import FDICTransFilerInfo
+
+
+class FDICInsider(Base):
+    """A stable identity for an insider across filings and institutions.
+
+    Each loaded disclosure's filers (or, without filer info, its file listing name) are matched to an
+    insider by a normalized name key, blocked by address: the same key matches when the ZIP codes
+    agree, or when the insider already files for the same cert. Otherwise a new insider is created.
+    Insider IDs are never reassigned, and the links in fdic_insider_filings are replaced whenever a
+    disclosure is (re)loaded."""
+    __tablename__ = 'fdic_insiders'
+
+    insider_id = Column(Integer, primary_key=True)
+    name_key = Column(String(100), nullable=False, index=True)
+    name = Column(String(100))
+    city = Column(String(100))
+    zip = Column(String(5))
+    created_date = Column(DateTime)
+
+    # Titles, suffixes and honorifics left out of name keys
+    NAME_AFFIXES = frozenset(("MR", "MRS", "MS", "DR", "JR", "SR", "II", "III", "IV", "ESQ", "MD", "PHD", "CPA"))
+
+    @classmethod
+    def make_name_key(cls, *parts):
+        """Returns an order-insensitive key for a name, e.g. "SMITH JOHN Q" and "John Q. Smith Jr." both
+        give "JOHN SMITH". Initials and affixes are dropped unless the name has nothing else."""
+        tokens = re.sub(r"[^A-Z ]", " ", " ".join(part for part in parts if part).upper().replace(".", "")).split()
+        key = sorted(token for token in tokens if len(token) > 1 and token not in FDICInsider.NAME_AFFIXES)
+        return " ".join(key or sorted(tokens))[:100]
+
+    @classmethod
+    def parse_zip(cls, value_string):
+        """Returns the 5 digit ZIP code from a ZIP or ZIP+4 string, or None"""
+        digits = re.sub(r"[^0-9]", "", value_string or "")
+        return digits[:5] if len(digits) >= 5 else None
+
+    @classmethod
+    def index_disclosure(cls, session, disclosure_id, filer_infos):
+        """Link a loaded disclosure to its insiders, replacing any earlier links.
+
+        filer_infos holds the disclosure's filer info as FDICTransFilerInfo objects or dicts keyed by
+        column name. Without any, the insider is identified by the name on the file listing."""
+        disclosure_id = int(disclosure_id)
+        # Re-indexing keeps the insiders the disclosure was already linked to
+        previous = [insider_id for (insider_id,) in session.query(FDICInsiderFiling.insider_id).filter(
+            FDICInsiderFiling.disclosure_id == disclosure_id)]
+        session.query(FDICInsiderFiling).filter(FDICInsiderFiling.disclosure_id == disclosure_id).delete(
+            synchronize_session=False)
+
+        filing = session.query(FDICFiling).get(disclosure_id)
+        cert_number = filing.cert_number if filing else None
+
+        filers = []
+        for i, info in enumerate(filer_infos):
+            if not isinstance(info, dict):
+                info = {column: getattr(info, column) for column in ("info_number", "name", "city", "zip")}
+            if info.get("name"):
+                filers.append((info.get("info_number", i + 1), info["name"], info.get("city"), info.get("zip")))
+        if not filers and filing and (filing.last_name or filing.first_name):
+            filers.append((None, " ".join(part for part in (filing.first_name, filing.middle, filing.last_name)
+                                          if part), None, None))
+
+        insider_ids = set()
+        for info_number, name, city, zip in filers:
+            insider = FDICInsider.match(session, name, city, zip, cert_number, previous)
+            if insider.insider_id not in insider_ids:
+                insider_ids.add(insider.insider_id)
+                session.add(FDICInsiderFiling(insider.insider_id, disclosure_id, cert_number, info_number))
+        return insider_ids
+
+    @classmethod
+    def match(cls, session, name, city=None, zip=None, cert_number=None, previous=()):
+        """Returns the insider for a filer's name and address, creating one when none matches.
+        Candidates in previous (insider IDs) match first."""
+        name_key = FDICInsider.make_name_key(name)
+        zip = FDICInsider.parse_zip(zip)
+        candidates = session.query(FDICInsider).filter(FDICInsider.name_key == name_key).order_by(
+            FDICInsider.insider_id).all()
+
+        insider = next((candidate for candidate in candidates if candidate.insider_id in previous), None)
+        if insider is None and zip:
+            insider = next((candidate for candidate in candidates if candidate.zip == zip), None)
+        if insider is None and cert_number is not None and candidates:
+            linked = session.query(FDICInsiderFiling.insider_id).filter(
+                FDICInsiderFiling.insider_id.in_([candidate.insider_id for candidate in candidates]),
+                FDICInsiderFiling.cert_number == cert_number
+            ).first()
+            if linked:
+                insider = next(candidate for candidate in candidates if candidate.insider_id == linked[0])
+        if insider is None and zip:
+            # An insider first seen without an address takes this one
+            insider = next((candidate for candidate in candidates if candidate.zip is None), None)
+
+        if insider is None:
+            insider = FDICInsider(name_key, name, city, zip)
+            session.add(insider)
+            session.flush()
+        elif zip and insider.zip is None:
+            insider.zip, insider.city = zip, city
+        return insider
+
+    @classmethod
+    def rebuild(cls, session, discl_ids, chunk_size=500, on_progress=None):
+        """Index the insiders of every disclosure in discl_ids, committing after each chunk"""
+        discl_ids = sorted(discl_ids)
+        for i in range(0, len(discl_ids), chunk_size):
+            chunk = discl_ids[i:i + chunk_size]
+            filer_infos = {disclosure_id: [] for disclosure_id in chunk}
+            for info in session.query(FDICTransFilerInfo).filter(FDICTransFilerInfo.disclosure_id.in_(chunk)):
+                filer_infos[info.disclosure_id].append(info)
+
+            for disclosure_id in chunk:
+                FDICInsider.index_disclosure(session, disclosure_id, filer_infos[disclosure_id])
+            session.commit()
+            if on_progress:
+                on_progress(i + len(chunk))
+        return len(discl_ids)
+
+    @classmethod
+    def find(cls, session, name, zip=None):
+        """Returns the insiders whose name key matches name (and zip, if given)"""
+        query = session.query(FDICInsider).filter(FDICInsider.name_key == FDICInsider.make_name_key(name))
+        if zip:
+            query = query.filter(FDICInsider.zip == FDICInsider.parse_zip(zip))
+        return query.order_by(FDICInsider.insider_id).all()
+
+    @classmethod
+    def get_filings(cls, session, insider_id):
+        """Returns the FDICFiling of every disclosure linked to insider_id, newest first"""
+        return session.query(FDICFiling).join(
+            FDICInsiderFiling, FDICInsiderFiling.disclosure_id == FDICFiling.disclosure_id
+        ).filter(FDICInsiderFiling.insider_id == insider_id).order_by(FDICFiling.filing_date.desc()).all()
+
+    @classmethod
+    def get_certs(cls, session, insider_id):
+        """Returns the cert numbers of every institution where insider_id reports"""
+        return sorted(cert for (cert,) in session.query(FDICInsiderFiling.cert_number).filter(
+            FDICInsiderFiling.insider_id == insider_id).distinct() if cert is not None)
+
+    def __init__(self, name_key, name, city=None, zip=None):
+        self.name_key = name_key
+        self.name = name[0:100] if name else None
+        self.city = city
+        self.zip = zip
+        self.created_date = datetime.now()
+
+    def __repr__(self):
+        return "<FDICInsider(insider_id=%s, name_key='%s', zip=%s)>" % (self.insider_id, self.name_key, self.zip)
+
+
+class FDICInsiderFiling(Base):
+    __tablename__ = 'fdic_insider_filings'
+
+    insider_id = Column(Integer, ForeignKey("fdic_insiders.insider_id"), primary_key=True)
+    disclosure_id = Column(Integer, ForeignKey("fdic_filings.disclosure_id"), primary_key=True, index=True)
+    # Copied from fdic_filings, so an insider's institutions are read from this table's index alone
+    cert_number = Column(Integer, index=True)
+    # The filer info row identifying the insider, or None when identified by the file listing name
+    info_number = Column(Integer)
+
+    def __init__(self, insider_id, disclosure_id, cert_number, info_number=None):
+        self.insider_id = insider_id
+        self.disclosure_id = int(disclosure_id)
+        self.cert_number = cert_number
+        self.info_number = info_number
+
+    def __repr__(self):
+        return "<FDICInsiderFiling(insider_id=%d, disclosure_id=%d)>" % (self.insider_id, self.disclosure_id)
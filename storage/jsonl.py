@@ -0,0 +1,76 @@
+import gzip
+import json
+import os
+import re
+import sys
+from datetime import date
+
+
+class JSONLinesWriter():
+    """Writes one JSON object per line to stdout, or to a directory of rotating gzip files.
+
+    Files are named <prefix>-00001.jsonl.gz, <prefix>-00002.jsonl.gz, ..., and a new file is
+    started after every max_records objects. Numbering continues after the highest numbered file
+    already in the directory, so a later run adds to earlier output rather than overwriting it."""
+
+    def __init__(self, directory=None, prefix="disclosures", max_records=10000):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_records = max_records
+        self.records = 0
+        self.file_number = 0
+        self._outfile = None
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.file_number = self.get_last_file_number(directory, prefix)
+
+    def write(self, obj):
+        if self.directory:
+            if self._outfile is None or self.records % self.max_records == 0:
+                self._rotate()
+            outfile = self._outfile
+        else:
+            outfile = sys.stdout
+
+        outfile.write(json.dumps(obj, default=JSONLinesWriter._default))
+        outfile.write("\n")
+        self.records += 1
+
+    def close(self):
+        if self._outfile is not None:
+            self._outfile.close()
+            self._outfile = None
+        else:
+            sys.stdout.flush()
+
+    def _rotate(self):
+        if self._outfile is not None:
+            self._outfile.close()
+        self.file_number += 1
+        filename = os.path.join(self.directory, "%s-%05d.jsonl.gz" % (self.prefix, self.file_number))
+        # Never overwrite an existing file, should one appear after the directory was listed
+        self._outfile = gzip.open(filename, "xt", encoding="utf-8")
+
+    @classmethod
+    def get_last_file_number(cls, directory, prefix):
+        """Returns the highest file number written to directory with prefix, or 0"""
+        pattern = re.compile(r"%s-(\d+)\.jsonl\.gz$" % re.escape(prefix))
+        numbers = [int(match.group(1)) for match in map(pattern.match, os.listdir(directory)) if match]
+        return max(numbers, default=0)
+
+    @classmethod
+    def _default(cls, value):
+        # Dates are the only non-JSON types in the normalized records
+        if isinstance(value, date):
+            return value.isoformat()
+        raise TypeError("%r is not JSON serializable" % value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return "<JSONLinesWriter(directory=%s, records=%d)>" % (self.directory, self.records)
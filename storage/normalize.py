@@ -0,0 +1,187 @@
+from datetime import datetime
+
+
+class FDICRowNormalizer():
+    """Maps parsed table rows to normalized column values, independent of any DB session.
+
+    Each record method returns a dict keyed by the DB column name, so the output can be
+    loaded through the ORM models, inserted directly, or serialized as-is."""
+
+    DATE_FORMAT = "%m/%d/%Y"
+
+    FILER_INFO_KEYWORDS = ("Relationship", "Name", "City", "State", "Street", "ZIP")
+    ISSUER_INFO_KEYWORDS = ("Name", "Earliest", "Event", "Ticker", "Amendment")
+
+    # Keywords common to Table 1 (Non-derivative) and Table 2 (derivative)
+    TRADE_KEYWORDS = ("Transaction Date", "Code", "Execution Date", "Form", "Beneficially Owned", "Nature of")
+    DERIVATIVE_KEYWORDS = ("Title of Derivative Security", "Exercise Price", "Derivative Securities Acquired",
+                           "Exercisable", "Expiration ", "Title of Underlying Securities",
+                           "Amount of Underlying Securities", "Price of Derivative Security")
+    NON_DERIVATIVE_KEYWORDS = ("Amount of Securities Acquired", "Title of Security", "Price of Securities Acquired")
+
+    @classmethod
+    def map_columns(cls, keyword_map, row_data):
+        """Associates keywords, each corresponding to data items, with the full column
+         name parsed from the source document."""
+        for keyword in keyword_map.keys():
+            for column in row_data.keys():
+                if keyword in column:
+                    keyword_map[keyword] = column
+                    break
+        return keyword_map
+
+    @classmethod
+    def keyword_values(cls, keywords, row_data, columns=None):
+        """Returns a dict of each keyword and the row value from its matching column (or None).
+        columns is a keyword map precompiled for the row's headers, which skips the column matching."""
+        keyword_map = columns if columns is not None else cls.map_columns(dict.fromkeys(keywords), row_data)
+        return {keyword: row_data.get(column) for keyword, column in keyword_map.items()}
+
+    @classmethod
+    def get_keywords(cls, kind, derivative=False):
+        """Returns the column keywords for a record kind (issuer_info, filer_info or trades)"""
+        if kind == "issuer_info":
+            return cls.ISSUER_INFO_KEYWORDS
+        elif kind == "filer_info":
+            return cls.FILER_INFO_KEYWORDS
+        elif derivative:
+            return cls.TRADE_KEYWORDS + cls.DERIVATIVE_KEYWORDS
+        else:
+            return cls.TRADE_KEYWORDS + cls.NON_DERIVATIVE_KEYWORDS
+
+    @classmethod
+    def parse_shares(cls, value_string):
+        """Returns all the numbers from a string as a single consolidated integer"""
+        if value_string:
+            shares_chars = [ch for ch in value_string if ch.isnumeric()]
+            if shares_chars:
+                return int(''.join(shares_chars))
+
+    @classmethod
+    def parse_acq(cls, value_string):
+        """Returns the acquisition/disposition flag appearing in parens beside Share values (e.g. (A))"""
+        if value_string:
+            for i, ch in enumerate(value_string):
+                if value_string[i - 1] == "(":
+                    return ch
+
+    @classmethod
+    def parse_price(cls, value_string):
+        """Returns a float/money number from an input string"""
+        if value_string:
+            price_chars = [ch for ch in value_string if ch.isnumeric() or ch == '.']
+            if price_chars:
+                return float(''.join(price_chars))
+
+    @classmethod
+    def parse_text(cls, value_string, max_length=None):
+        """Returns None for blank strings, otherwise returns a string limited by max_length (if necessary)"""
+        if value_string:
+            if max_length:
+                return value_string[0:max_length]
+            else:
+                return value_string
+        else:
+            return None
+
+    @classmethod
+    def parse_date(cls, value_string):
+        """Returns a date from a MM/DD/YYYY string, or None for blank or malformed strings"""
+        if value_string:
+            try:
+                return datetime.strptime(value_string.strip(), cls.DATE_FORMAT).date()
+            except ValueError:
+                return None
+
+    @classmethod
+    def parse_direct_own(cls, value_string):
+        """Returns False for indirect ownership, True for direct ownership, and None when blank"""
+        if value_string:
+            return "Indirect" not in value_string
+
+    @classmethod
+    def parse_v_flag(cls, value_string):
+        """Returns True when the voluntary reporting "V" flag is present, and False when blank"""
+        if value_string:
+            if "V" in value_string:
+                return True
+        else:
+            return False
+
+    @classmethod
+    def filer_info(cls, row_data, columns=None):
+        values = cls.keyword_values(cls.FILER_INFO_KEYWORDS, row_data, columns)
+        return {
+            "title": cls.parse_text(values["Relationship"], 100),
+            "name": cls.parse_text(values["Name"], 100),
+            "city": cls.parse_text(values["City"], 100),
+            "state": cls.parse_text(values["State"], 25),
+            "street": cls.parse_text(values["Street"], 100),
+            "zip": cls.parse_text(values["ZIP"], 20),
+        }
+
+    @classmethod
+    def issuer_info(cls, row_data, columns=None):
+        values = cls.keyword_values(cls.ISSUER_INFO_KEYWORDS, row_data, columns)
+        return {
+            "issuer_name": cls.parse_text(values["Name"], 100),
+            "issuer_ticker": cls.parse_text(values["Ticker"], 20),
+            # Form 3 filings report the "Date of Event" rather than the "Earliest" transaction date
+            "report_date": cls.parse_date(values["Earliest"] or values["Event"]),
+            "amendment_date": cls.parse_date(values["Amendment"]),
+        }
+
+    @classmethod
+    def trade(cls, row_data, derivative=False, columns=None):
+        # TODO Form 3 "Ownership" column where "Owership Form" usually appears
+        # TODO Form 3 derivative "Amount of Securities Underlying Derivative Security" differs
+        # http://www2.fdic.gov/efr/redirect.asp?Discl_id=847&InstNme=&InstCty=&CertNum=35095&InstSte=&sGoto=Institution
+        values = cls.keyword_values(cls.get_keywords("trades", derivative), row_data, columns)
+
+        # Common columns
+        trade = {
+            "trade_date": cls.parse_date(values["Transaction Date"]),
+            "code": cls.parse_text(values["Code"], 10),
+            "exec_date": cls.parse_date(values["Execution Date"]),
+            "direct_own": cls.parse_direct_own(values["Form"]),
+            "shares_owned": cls.parse_shares(values["Beneficially Owned"]),
+            "nature_of_own": cls.parse_text(values["Nature of"], 100),
+            "v_flag": cls.parse_v_flag(row_data.get("V")),
+            "derivative": derivative,
+        }
+
+        # Table-specific columns
+        if derivative:
+            trade.update({
+                "security": cls.parse_text(values["Title of Derivative Security"], 100),
+                "exercise_price": cls.parse_price(values["Exercise Price"]),
+                "trade_shares": cls.parse_shares(values["Derivative Securities Acquired"]),
+                "exercise_date": cls.parse_date(values["Exercisable"]),
+                "expire_date": cls.parse_date(values["Expiration "]),
+                "underlying_security": cls.parse_text(values["Title of Underlying Securities"], 100),
+                "underlying_shares": cls.parse_shares(values["Amount of Underlying Securities"]),
+                "trade_price": cls.parse_price(values["Price of Derivative Security"]),
+            })
+        else:
+            trade.update({
+                "security": cls.parse_text(values["Title of Security"], 100),
+                "exercise_price": None,
+                "trade_shares": cls.parse_shares(values["Amount of Securities Acquired"]),
+                "exercise_date": None,
+                "expire_date": None,
+                "underlying_security": None,
+                "underlying_shares": None,
+                "trade_price": cls.parse_price(values["Price of Securities Acquired"]),
+            })
+
+            # Form 3 type filings provide a bad header for "Security" for Non-Derivative trades.
+            # This exception locates and pulls the appropriate data in these cases.
+            if not trade["security"]:
+                goofy_header = ''.join([head for head in row_data.keys() if 'Title of' in head])
+                trade["security"] = cls.parse_text(row_data.get(goofy_header), 100)
+
+        return trade
+
+    @classmethod
+    def note(cls, row_data):
+        return {"footnote": cls.parse_text(row_data, 2500)}
@@ -0,0 +1,208 @@
+from datetime import date, datetime
+from sqlalchemy import (Column, Integer, String, DateTime, MetaData, Table, Index, select, union_all, extract,
+                        func, text)
+from storage.sqlsession import Base
+from storage.file_listing import FDICFiling
+from storage.transactions import FDICTransTrade, FDICTransNotes
+
+# Archive tables are created on demand, outside Base.metadata so create_all() never touches them
+ARCHIVE_METADATA = MetaData()
+
+
+class FDICTransPartition(Base):
+    """An optional hot/cold layout for the growing trades and notes tables, keyed by filing year.
+
+    New rows are inserted into fdic_trans_trades and fdic_trans_notes, the hot tier. compact()
+    moves a cold filing year's rows into a read-optimized archive table per year (for example
+    fdic_trans_trades_2009), loaded in disclosure order and indexed once after loading: a clustered
+    columnstore index on SQL Server, and a disclosure_id index elsewhere. The <table>_all views union
+    the hot table with its archives, for queries that span every year. Each archive is recorded here.
+    Disclosures of a compacted year that are loaded again (or for the first time) are moved into its
+    archives as they are loaded, so the year stays compacted until it is restored."""
+    __tablename__ = 'fdic_trans_partitions'
+
+    table_name = Column(String(100), primary_key=True)
+    base_table = Column(String(100), nullable=False)
+    filing_year = Column(Integer, nullable=False)
+    row_count = Column(Integer)
+    compacted_date = Column(DateTime)
+
+    PARTITIONED_TABLES = (FDICTransTrade.__table__, FDICTransNotes.__table__)
+
+    @classmethod
+    def get_archive_table(cls, table, year):
+        """Returns the archive Table for a partitioned table's filing year, with the same columns (and no keys)"""
+        name = "%s_%d" % (table.name, year)
+        if name in ARCHIVE_METADATA.tables:
+            return ARCHIVE_METADATA.tables[name]
+        return Table(name, ARCHIVE_METADATA, *[Column(column.name, column.type) for column in table.columns])
+
+    @classmethod
+    def get_view_name(cls, table):
+        return table.name + "_all"
+
+    @classmethod
+    def get_archives(cls, session, table=None):
+        """Returns the FDICTransPartition of each archive (of table, if given), oldest first"""
+        query = session.query(FDICTransPartition)
+        if table is not None:
+            query = query.filter(FDICTransPartition.base_table == table.name)
+        return query.order_by(FDICTransPartition.filing_year, FDICTransPartition.table_name).all()
+
+    @classmethod
+    def get_union(cls, session, table):
+        """Returns a selectable over the hot table and its archives. Without any archives, the hot table itself."""
+        archives = FDICTransPartition.get_archives(session, table)
+        if not archives:
+            return table
+        columns = [column.name for column in table.columns]
+        tables = [table] + [FDICTransPartition.get_archive_table(table, archive.filing_year) for archive in archives]
+        return union_all(*[select(*[t.c[column] for column in columns]) for t in tables]).subquery(
+            FDICTransPartition.get_view_name(table))
+
+    @classmethod
+    def get_hot_years(cls, session):
+        """Returns the filing years with rows in the hot tables, with their trade and note row counts"""
+        years = {}
+        for table in FDICTransPartition.PARTITIONED_TABLES:
+            year = extract("year", FDICFiling.filing_date)
+            for filing_year, count in session.execute(
+                    select(year, func.count(table.c.disclosure_id)).select_from(table.join(
+                        FDICFiling.__table__, table.c.disclosure_id == FDICFiling.__table__.c.disclosure_id
+                    )).group_by(year)):
+                if filing_year is not None:
+                    years.setdefault(int(filing_year), {})[table.name] = count
+        return years
+
+    @classmethod
+    def compact(cls, session, year):
+        """Move a filing year's trades and notes from the hot tables into their archives, and refresh the
+        views. Each table is moved in its own transaction. Returns the number of rows moved."""
+        moved = 0
+        for table in FDICTransPartition.PARTITIONED_TABLES:
+            moved += FDICTransPartition._compact_table(session, table, year)
+            session.commit()
+        FDICTransPartition.create_views(session)
+        session.commit()
+        return moved
+
+    @classmethod
+    def _compact_table(cls, session, table, year):
+        archive = FDICTransPartition.get_archive_table(table, year)
+        partition = session.query(FDICTransPartition).get(archive.name)
+        discl_ids = select(FDICFiling.disclosure_id).where(extract("year", FDICFiling.filing_date) == year)
+        columns = [column.name for column in table.columns]
+
+        archive.create(session.connection(), checkfirst=True)
+        result = session.execute(archive.insert().from_select(
+            columns, select(*[table.c[column] for column in columns]).where(
+                table.c.disclosure_id.in_(discl_ids)).order_by(table.c.disclosure_id, table.c.id)
+        ))
+        session.execute(table.delete().where(table.c.disclosure_id.in_(discl_ids)))
+
+        if partition is None:
+            # Index once, after the bulk load, rather than maintaining the index row by row
+            FDICTransPartition._index_archive(session, archive)
+            partition = FDICTransPartition(archive.name, table.name, year)
+            session.add(partition)
+        partition.row_count = session.execute(select(func.count(archive.c.disclosure_id))).scalar()
+        partition.compacted_date = datetime.now()
+        return max(result.rowcount, 0)
+
+    @classmethod
+    def _index_archive(cls, session, archive):
+        dialect = session.get_bind().dialect
+        if dialect.name == "mssql":
+            session.execute(text("CREATE CLUSTERED COLUMNSTORE INDEX %s ON %s" % (
+                dialect.identifier_preparer.quote("cci_" + archive.name),
+                dialect.identifier_preparer.quote(archive.name))))
+        else:
+            Index("ix_%s_disclosure_id" % archive.name, archive.c.disclosure_id).create(session.connection())
+
+    @classmethod
+    def restore(cls, session, year):
+        """Move a filing year's archived rows back into the hot tables, drop its archives, and refresh the views"""
+        for table in FDICTransPartition.PARTITIONED_TABLES:
+            archive = FDICTransPartition.get_archive_table(table, year)
+            partition = session.query(FDICTransPartition).get(archive.name)
+            if partition is None:
+                continue
+
+            # Rows are given new IDs, since the hot table may have reused theirs (as SQLite does
+            # for the highest rowids once they are deleted)
+            columns = [column.name for column in table.columns if column.name != "id"]
+            session.execute(table.insert().from_select(columns, select(*[archive.c[column] for column in columns])
+                                                       .order_by(archive.c.disclosure_id, archive.c.id)))
+            session.delete(partition)
+            session.flush()
+            archive.drop(session.connection())
+            session.commit()
+        FDICTransPartition.create_views(session)
+        session.commit()
+
+    @classmethod
+    def create_views(cls, session):
+        """(Re)create each <table>_all view over the hot table and its archives"""
+        dialect = session.get_bind().dialect
+        quote = dialect.identifier_preparer.quote
+        for table in FDICTransPartition.PARTITIONED_TABLES:
+            view = quote(FDICTransPartition.get_view_name(table))
+            columns = ", ".join(quote(column.name) for column in table.columns)
+            names = [table.name] + [archive.table_name for archive in FDICTransPartition.get_archives(session, table)]
+
+            session.execute(text("DROP VIEW IF EXISTS %s" % view))
+            session.execute(text("CREATE VIEW %s AS %s" % (view, " UNION ALL ".join(
+                "SELECT %s FROM %s" % (columns, quote(name)) for name in names))))
+
+    @classmethod
+    def get_disclosure_archives(cls, session, disclosure_id):
+        """Returns the FDICTransPartition of each archive for a disclosure's filing year, if that year is compacted"""
+        return session.query(FDICTransPartition).join(
+            FDICFiling, extract("year", FDICFiling.filing_date) == FDICTransPartition.filing_year
+        ).filter(FDICFiling.disclosure_id == int(disclosure_id)).all()
+
+    @classmethod
+    def archive_disclosure(cls, session, disclosure_id):
+        """Move a disclosure's rows from the hot tables into the archives of its filing year, if that year is
+        compacted. Called once a disclosure's rows are (re)loaded. Returns the number of rows moved."""
+        archives = FDICTransPartition.get_disclosure_archives(session, disclosure_id)
+        if archives:
+            # Rows added through the ORM are not in the hot tables until flushed
+            session.flush()
+        moved = 0
+        for partition in archives:
+            table = Base.metadata.tables[partition.base_table]
+            archive = FDICTransPartition.get_archive_table(table, partition.filing_year)
+            columns = [column.name for column in table.columns]
+            result = session.execute(archive.insert().from_select(
+                columns, select(*[table.c[column] for column in columns]).where(
+                    table.c.disclosure_id == int(disclosure_id)).order_by(table.c.id)
+            ))
+            session.execute(table.delete().where(table.c.disclosure_id == int(disclosure_id)))
+            partition.row_count = (partition.row_count or 0) + max(result.rowcount, 0)
+            moved += max(result.rowcount, 0)
+        return moved
+
+    @classmethod
+    def delete_archived(cls, session, disclosure_id):
+        """Delete a disclosure's rows from the archives of its filing year, if that year is compacted"""
+        for partition in FDICTransPartition.get_disclosure_archives(session, disclosure_id):
+            table = FDICTransPartition.get_archive_table(
+                Base.metadata.tables[partition.base_table], partition.filing_year)
+            result = session.execute(table.delete().where(table.c.disclosure_id == int(disclosure_id)))
+            partition.row_count = max((partition.row_count or 0) - max(result.rowcount, 0), 0)
+
+    @classmethod
+    def get_cold_years(cls, session, hot_years, today=None):
+        """Returns the filing years in the hot tables older than the newest hot_years years"""
+        cutoff = (today or date.today()).year - hot_years + 1
+        return sorted(year for year in FDICTransPartition.get_hot_years(session) if year < cutoff)
+
+    def __init__(self, table_name, base_table, filing_year):
+        self.table_name = table_name
+        self.base_table = base_table
+        self.filing_year = filing_year
+        self.row_count = 0
+
+    def __repr__(self):
+        return "<FDICTransPartition(table_name='%s', row_count=%s)>" % (self.table_name, self.row_count)
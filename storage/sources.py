@@ -0,0 +1,52 @@
+import zlib
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, LargeBinary
+from storage.sqlsession import Base
+
+
+class FDICTransSource(Base):
+    __tablename__ = 'fdic_trans_sources'
+
+    disclosure_id = Column(Integer, ForeignKey("fdic_filings.disclosure_id"), primary_key=True)
+    compression = Column(String(10))
+    source = Column(LargeBinary)
+    fetched_date = Column(DateTime)
+
+    """ Returns a list of disclosure_ids with a stored source."""
+    @classmethod
+    def get_local_discl(cls, session):
+        return [disclosure_id for (disclosure_id,) in session.query(FDICTransSource.disclosure_id)]
+
+    @classmethod
+    def iter_sources(cls, engine, discl_ids, chunk_size=200):
+        """Yields (disclosure_id, compression, source) for discl_ids, reading chunk_size rows at a time
+        on a dedicated connection (so it can feed a worker pool from another thread)."""
+        table = FDICTransSource.__table__
+        with engine.connect() as conn:
+            for i in range(0, len(discl_ids), chunk_size):
+                query = table.select().where(table.c.disclosure_id.in_(discl_ids[i:i + chunk_size]))
+                # Fetch the whole chunk, so no read cursor stays open while the caller writes
+                rows = conn.execute(query).fetchall()
+                for row in rows:
+                    yield row.disclosure_id, row.compression, row.source
+
+    @classmethod
+    def compress(cls, html):
+        return zlib.compress(html.encode("utf-8"), 9)
+
+    @classmethod
+    def decompress(cls, source, compression="zlib"):
+        if compression == "zlib":
+            return zlib.decompress(source).decode("utf-8")
+        raise ValueError("Unknown source compression %s" % compression)
+
+    def __init__(self, disclosure_id, html):
+        self.disclosure_id = int(disclosure_id)
+        self.compression = "zlib"
+        self.source = FDICTransSource.compress(html)
+        self.fetched_date = datetime.now()
+
+    def __repr__(self):
+        return "<FDICTransSource(disclosure_id=%d, compression='%s', bytes=%d)>" % (
+            self.disclosure_id, self.compression, len(self.source or b"")
+        )
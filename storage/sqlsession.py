@@ -1,13 +1,22 @@
+import os
+import sys
 from contextlib import contextmanager
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 
 @contextmanager
-def session_scope(engine):
-    Session = sessionmaker()
+def session_scope(engine, row_budget=None, byte_budget=None):
+    """Yields a session that commits on success and rolls back on error.
+
+    With a row_budget or byte_budget, the session is a BudgetedSession, which commits and expunges
+    as it goes so that long runs stay within a fixed memory ceiling."""
+    if row_budget or byte_budget:
+        Session = sessionmaker(class_=BudgetedSession, row_budget=row_budget, byte_budget=byte_budget)
+    else:
+        Session = sessionmaker()
     session = Session.configure(bind=engine)
     session = Session()
 
@@ -19,3 +28,107 @@ def session_scope(engine):
         raise
     finally:
         session.close()
+
+
+@contextmanager
+def hold_checkpoints(session):
+    """Defers a BudgetedSession's checkpoints until the block ends, so the block's writes are committed
+    together and the objects it loaded stay attached. Any other session is left as it is."""
+    if not isinstance(session, BudgetedSession):
+        yield session
+        return
+
+    session._held += 1
+    try:
+        yield session
+    finally:
+        session._held -= 1
+    if not session._held:
+        session.check_budget()
+
+
+def get_rss():
+    """Returns the resident set size of this process in bytes, or the peak RSS where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as infile:
+            return int(infile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+        except ImportError:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class BudgetedSession(Session):
+    """A session that flushes, commits and expunges every object once row_budget objects, or an
+    estimated byte_budget bytes, have been added since the last checkpoint.
+
+    Objects are detached at each checkpoint, so callers must not hold on to ORM objects across
+    add() calls and expect them to stay attached (or to have their changes saved), except inside
+    hold_checkpoints()."""
+
+    def __init__(self, row_budget=None, byte_budget=None, **kwargs):
+        # Expunged objects keep their loaded values rather than raising on access
+        kwargs["expire_on_commit"] = False
+        super().__init__(**kwargs)
+        self.row_budget = row_budget
+        self.byte_budget = byte_budget
+        self.rows_pending = 0
+        self.bytes_pending = 0
+        self.rows_total = 0
+        self.checkpoints = 0
+        # The depth of hold_checkpoints() blocks
+        self._held = 0
+
+    def add(self, instance, _warn=True):
+        super().add(instance, _warn)
+        self._count(instance)
+        self.check_budget()
+
+    def add_all(self, instances):
+        # Only checkpoint between batches, so the rows of one batch are committed together
+        with hold_checkpoints(self):
+            super().add_all(instances)
+
+    def merge(self, instance, *args, **kwargs):
+        merged = super().merge(instance, *args, **kwargs)
+        self._count(instance)
+        self.check_budget()
+        return merged
+
+    def check_budget(self):
+        if self._held:
+            return
+        if ((self.row_budget and self.rows_pending >= self.row_budget) or
+                (self.byte_budget and self.bytes_pending >= self.byte_budget)):
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Commit everything pending, and drop all objects from the identity map"""
+        self.commit()
+        self.expunge_all()
+        self.rows_pending = self.bytes_pending = 0
+        self.checkpoints += 1
+
+    def counters(self):
+        return {
+            "rows_total": self.rows_total,
+            "rows_pending": self.rows_pending,
+            "bytes_pending": self.bytes_pending,
+            "checkpoints": self.checkpoints,
+            "identity_map_size": len(self.identity_map),
+            "new_size": len(self.new),
+            "rss": get_rss()
+        }
+
+    @classmethod
+    def estimate_size(cls, instance):
+        """Returns a rough size in bytes of an ORM object and its attribute values"""
+        return sys.getsizeof(instance) + sum(sys.getsizeof(value) for value in vars(instance).values())
+
+    def _count(self, instance):
+        self.rows_pending += 1
+        self.rows_total += 1
+        if self.byte_budget:
+            self.bytes_pending += BudgetedSession.estimate_size(instance)
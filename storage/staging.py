@@ -0,0 +1,79 @@
+from sqlalchemy import Table, Column, text
+from storage.sqlsession import Base
+
+
+class FDICStagingUpsert():
+    """Applies batches of scraped rows to a table with one set-based upsert.
+
+    Rows are bulk inserted into a constraint-free staging table (<table>_staging), which is then
+    merged into the target table by primary key: MERGE on SQL Server, INSERT ... ON CONFLICT on
+    PostgreSQL and SQLite, and ON DUPLICATE KEY UPDATE on MySQL. Existing rows are updated with
+    the staged values, so changed names and listing details are carried over."""
+
+    def __init__(self, model):
+        self.target = model.__table__
+        self.key = [column.name for column in self.target.primary_key.columns]
+        self.columns = [column.name for column in self.target.columns]
+        # A single integer primary key is created as an IDENTITY column on SQL Server, which only
+        # accepts explicit values with IDENTITY_INSERT on (as SQLAlchemy itself does for ORM inserts)
+        self.identity_key = self.target._autoincrement_column is not None
+        self.staging = Table(
+            self.target.name + "_staging", Base.metadata,
+            *[Column(column.name, column.type) for column in self.target.columns],
+            info={"staging_for": self.target.name}
+        )
+
+    def upsert(self, session, rows):
+        """Stage and upsert a list of dicts keyed by column name. Returns the number of rows applied."""
+        # A key may appear only once per upsert, so the last row for each key wins
+        rows = list({tuple(row[k] for k in self.key): row for row in rows}.values())
+        if not rows:
+            return 0
+
+        dialect = session.get_bind().dialect
+        session.execute(self.staging.delete())
+        session.execute(self.staging.insert(), rows)
+
+        identity_insert = dialect.name == "mssql" and self.identity_key
+        if identity_insert:
+            session.execute(text("SET IDENTITY_INSERT %s ON" % dialect.identifier_preparer.quote(self.target.name)))
+        try:
+            session.execute(text(self.get_upsert_sql(dialect)))
+        finally:
+            if identity_insert:
+                session.execute(text("SET IDENTITY_INSERT %s OFF" % dialect.identifier_preparer.quote(
+                    self.target.name)))
+        session.execute(self.staging.delete())
+        return len(rows)
+
+    def get_upsert_sql(self, dialect):
+        quote = dialect.identifier_preparer.quote
+        target, staging = quote(self.target.name), quote(self.staging.name)
+        columns = ', '.join(quote(c) for c in self.columns)
+        updates = [c for c in self.columns if c not in self.key]
+
+        if dialect.name == "mssql":
+            return ("MERGE INTO %s AS t USING %s AS s ON %s "
+                    "WHEN MATCHED THEN UPDATE SET %s "
+                    "WHEN NOT MATCHED THEN INSERT (%s) VALUES (%s);") % (
+                target, staging,
+                ' AND '.join("t.%s = s.%s" % (quote(c), quote(c)) for c in self.key),
+                ', '.join("t.%s = s.%s" % (quote(c), quote(c)) for c in updates),
+                columns, ', '.join("s.%s" % quote(c) for c in self.columns)
+            )
+        elif dialect.name in ("postgresql", "sqlite"):
+            # "WHERE true" resolves SQLite's INSERT ... SELECT ... ON CONFLICT parsing ambiguity
+            return "INSERT INTO %s (%s) SELECT %s FROM %s WHERE true ON CONFLICT (%s) DO UPDATE SET %s" % (
+                target, columns, columns, staging, ', '.join(quote(c) for c in self.key),
+                ', '.join("%s = excluded.%s" % (quote(c), quote(c)) for c in updates)
+            )
+        elif dialect.name == "mysql":
+            return "INSERT INTO %s (%s) SELECT %s FROM %s ON DUPLICATE KEY UPDATE %s" % (
+                target, columns, columns, staging,
+                ', '.join("%s = VALUES(%s)" % (quote(c), quote(c)) for c in updates)
+            )
+        else:
+            raise NotImplementedError("No staging upsert for the %s dialect" % dialect.name)
+
+    def __repr__(self):
+        return "<FDICStagingUpsert(target=%s)>" % self.target.name
@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+from sqlalchemy.orm import sessionmaker
+
+
+class FDICBackgroundWriter(threading.Thread):
+    """Loads batches of ORM objects on a dedicated thread and session, so DB writes overlap network I/O.
+
+    Batches are passed through a bounded queue with put(), and committed once commit_rows objects
+    or commit_seconds have accumulated. An error on the writer thread is raised by the next put()
+    or by close(). close() (or leaving the with block) flushes and commits anything outstanding."""
+
+    _STOP = object()
+
+    def __init__(self, engine, max_batches=16, commit_rows=1000, commit_seconds=5.0):
+        super().__init__(name="FDICBackgroundWriter", daemon=True)
+        self.engine = engine
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        self.rows_written = 0
+        self.commits = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_batches)
+
+    def put(self, records, merge=(), after=()):
+        """Queue records to be added (and merge to be merged) in the writer's session, then call each of
+        after with that session. Blocks while the queue is full, and raises the writer's error if it has failed."""
+        while True:
+            self._raise_error()
+            if not self.is_alive():
+                raise RuntimeError("The background writer is not running")
+            try:
+                self._queue.put((records, merge, after), timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        """Wait for the queued batches to be committed, and raise the writer's error if it failed"""
+        if self.is_alive():
+            self._queue.put(FDICBackgroundWriter._STOP)
+            self.join()
+        self._raise_error()
+
+    def run(self):
+        session = sessionmaker(bind=self.engine)()
+        pending = 0
+        last_commit = time.monotonic()
+
+        try:
+            while True:
+                timeout = max(self.commit_seconds - (time.monotonic() - last_commit), 0.01)
+                try:
+                    batch = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    batch = None
+
+                if batch is FDICBackgroundWriter._STOP:
+                    break
+                elif batch is not None and self.error is None:
+                    records, merge, after = batch
+                    try:
+                        session.add_all(records)
+                        for record in merge:
+                            session.merge(record)
+                        for callback in after:
+                            callback(session)
+                        pending += len(records) + len(merge)
+                    except Exception as e:
+                        self._fail(session, e)
+
+                # Commit on a size or time threshold. After a failure, batches are discarded.
+                if self.error is not None:
+                    pending = 0
+                elif pending and (pending >= self.commit_rows or
+                                  time.monotonic() - last_commit >= self.commit_seconds):
+                    self._commit(session, pending)
+                    pending = 0
+                if not pending:
+                    last_commit = time.monotonic()
+
+            if pending and self.error is None:
+                self._commit(session, pending)
+        finally:
+            session.close()
+
+    def _commit(self, session, pending):
+        try:
+            session.commit()
+            session.expunge_all()
+            self.rows_written += pending
+            self.commits += 1
+        except Exception as e:
+            self._fail(session, e)
+
+    def _fail(self, session, error):
+        # Keep draining the queue after a failure, so producers blocked in put() are released
+        session.rollback()
+        self.error = error
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.is_alive():
+            # Already failing, so don't mask the original error with the writer's
+            self._queue.put(FDICBackgroundWriter._STOP)
+            self.join()
+
+    def __repr__(self):
+        return "<FDICBackgroundWriter(rows_written=%d, commits=%d)>" % (self.rows_written, self.commits)